@@ -0,0 +1,220 @@
+"""
+Journal d'activité : qui s'est connecté, a uploadé, téléchargé, changé
+ses réglages...
+
+Les routeurs appellent record(...), qui ne fait qu'ajouter l'événement à
+un buffer circulaire en mémoire : aucune écriture disque dans la requête.
+flush_loop() (lancée par le lifespan) écrit le buffer par lots, toutes les
+`flush_interval` secondes, dans une base SQLite séparée (logs/activity.db,
+en ajout seulement) pour ne pas concurrencer les écritures de
+home_container.db. Si le disque ne suit pas, le buffer garde les
+`buffer_size` événements les plus récents et compte ceux perdus.
+
+Avec plusieurs workers, chacun a son buffer : un événement est visible
+dans /admin/activity au plus `flush_interval` secondes après.
+
+Section "activity" de config/settings.json.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import (
+    Column, Float, Index, Integer, MetaData, String, Table, and_, create_engine, delete, event,
+    insert, or_, select,
+)
+from starlette.concurrency import run_in_threadpool
+
+from .config import get_section
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULTS = {
+    "db_path": "logs/activity.db",
+    "buffer_size": 10000,
+    "flush_interval": 2,
+    "keep_days": 90,
+}
+
+metadata = MetaData()
+
+activity = Table(
+    "activity",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("ts", Float, nullable=False),  # time.time()
+    Column("user", String, nullable=True),
+    Column("action", String, nullable=False),
+    Column("target", String, nullable=True),
+    Column("ip", String, nullable=True),
+    Column("details", String, nullable=True),  # JSON
+    Index("ix_activity_ts", "ts"),
+    Index("ix_activity_user_ts", "user", "ts"),
+    Index("ix_activity_action_ts", "action", "ts"),
+)
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    return get_section("activity", DEFAULTS)
+
+
+@lru_cache(maxsize=None)
+def get_engine():
+    path = ROOT_DIR / get_settings()["db_path"]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    activity_engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(activity_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    return activity_engine
+
+
+def init_activity_db():
+    """Création de la table (appelé par init_db, sous son verrou)."""
+    metadata.create_all(bind=get_engine())
+
+
+class ActivityLog:
+    def __init__(self, buffer_size: int):
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+
+    def record(self, action: str, user: str = None, target=None, ip: str = None, **details):
+        row = {
+            "ts": time.time(),
+            "user": user,
+            "action": action,
+            "target": None if target is None else str(target),
+            "ip": ip,
+            "details": json.dumps(details, default=str) if details else None,
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(row)
+
+    def flush(self) -> int:
+        """Écrit le contenu du buffer en une transaction."""
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        if not rows:
+            return 0
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(insert(activity), rows)
+        except Exception:
+            # on remet les événements devant les nouveaux (dans la limite du
+            # buffer : les plus anciens qui n'y tiennent plus sont perdus)
+            with self._lock:
+                kept = rows + list(self._buffer)
+                self.dropped += max(0, len(kept) - self._buffer.maxlen)
+                self._buffer.clear()
+                self._buffer.extend(kept)
+            raise
+        self.written += len(rows)
+        return len(rows)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+
+@lru_cache(maxsize=None)
+def get_activity_log() -> ActivityLog:
+    return ActivityLog(int(get_settings()["buffer_size"]))
+
+
+def record(action: str, user: str = None, target=None, request=None, **details):
+    """Point d'entrée des routeurs. `request` sert à noter l'IP du client."""
+    ip = request.client.host if request is not None and request.client else None
+    get_activity_log().record(action, user=user, target=target, ip=ip, **details)
+
+
+def prune(keep_days: float) -> int:
+    with get_engine().begin() as conn:
+        result = conn.execute(delete(activity).where(activity.c.ts < time.time() - keep_days * 86400))
+        return result.rowcount
+
+
+async def flush_loop():
+    """Tâche de fond lancée par le lifespan."""
+    conf = get_settings()
+    interval = float(conf["flush_interval"])
+    log = get_activity_log()
+    last_prune = 0.0
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(log.flush)
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    await run_in_threadpool(prune, float(conf["keep_days"]))
+            except Exception:
+                logger.exception("Écriture du journal d'activité échouée")
+    finally:
+        # arrêt du serveur : on écrit les derniers événements
+        await run_in_threadpool(log.flush)
+
+
+def query(user: str = None, action: str = None, since: float = None, until: float = None,
+          before: tuple = None, limit: int = 100) -> list:
+    """
+    Événements de [since, until[, les plus récents d'abord (à "ts" égal, par
+    id décroissant). Filtre et tri sont servis par les index (user, ts),
+    (action, ts) ou ts. Pour la page suivante, repasser ("ts", "id") du
+    dernier événement reçu comme `before` : les événements de même "ts" ne
+    sont ni sautés ni répétés.
+    """
+    stmt = select(activity)
+    if user is not None:
+        stmt = stmt.where(activity.c.user == user)
+    if action is not None:
+        stmt = stmt.where(activity.c.action == action)
+    if since is not None:
+        stmt = stmt.where(activity.c.ts >= since)
+    if until is not None:
+        stmt = stmt.where(activity.c.ts < until)
+    if before is not None:
+        before_ts, before_id = before
+        stmt = stmt.where(or_(
+            activity.c.ts < before_ts,
+            and_(activity.c.ts == before_ts, activity.c.id < before_id),
+        ))
+    stmt = stmt.order_by(activity.c.ts.desc(), activity.c.id.desc()).limit(limit)
+    with get_engine().connect() as conn:
+        rows = conn.execute(stmt).all()
+    return [
+        {
+            "id": r.id,
+            "ts": r.ts,
+            "user": r.user,
+            "action": r.action,
+            "target": r.target,
+            "ip": r.ip,
+            "details": json.loads(r.details) if r.details else None,
+        }
+        for r in rows
+    ]
+
+
+def stats() -> dict:
+    log = get_activity_log()
+    return {"pending": log.pending(), "written": log.written, "dropped": log.dropped}
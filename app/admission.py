@@ -0,0 +1,310 @@
+"""
+Contrôle d'admission des écritures (upload, delta de synchronisation).
+
+Le Pi écrit sur un SSD USB alimenté par une batterie : disque plein ou SSD
+saturé en plein upload, c'est un fichier à moitié écrit et un utilisateur
+qui a attendu pour rien. On refuse donc l'écriture avant de lire le corps
+de la requête :
+
+- place : l'espace libre du disque de data/, moins ce que les écritures en
+  cours ont déjà réservé (tous workers confondus, voir shared_state.py),
+  doit couvrir le Content-Length annoncé plus une marge `min_free_bytes`.
+  Sinon 507. L'espace libre baisse déjà à mesure que l'écriture avance :
+  la réservation est ramenée à ce qui reste à écrire toutes les
+  `progress_bytes` octets (checkpoint()), pour ne pas compter deux fois les
+  octets écrits. Elle est libérée à la fin de la requête, réussie ou non.
+- latence : un write() ne fait que remplir le cache de pages, il ne dit
+  rien du SSD. À chaque checkpoint(), les écritures (upload et delta) sont
+  donc poussées sur le disque par un os.fsync chronométré (secondes par Mo,
+  fenêtre glissante de `window_seconds`). Si le p90 dépasse
+  `max_seconds_per_mb`, le SSD est saturé (throttling thermique, alim
+  trop faible...) : 503 avec Retry-After. Les mesures sont propres à
+  chaque worker. checkpoint() bloque : à appeler hors de la boucle
+  asyncio.
+
+Le contrôle est fait par un middleware ASGI : avec FastAPI, le corps d'un
+upload est entièrement reçu (et écrit dans un fichier temporaire) avant
+que le handler ne soit appelé, c'est donc trop tard dans upload_file. Le
+middleware passe l'id de la réservation au handler dans
+request.state.write_reservation.
+
+Section "admission" de config/settings.json.
+"""
+import itertools
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import delete, func, insert, literal, select, update
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from .config import get_section
+from .database import engine
+from .shared_state import instance_token, write_reservations
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+DEFAULTS = {
+    "min_free_bytes": 512 * 1024 * 1024,
+    "window_seconds": 30,
+    "min_samples": 5,
+    "max_seconds_per_mb": 0.5,
+    "retry_after": 30,
+    "progress_bytes": 16 * 1024 * 1024,
+    "write_paths": [r"^/workspace/upload$", r"^/sync/files/\d+/delta$"],
+}
+
+_MB = 1024 * 1024
+# en dessous, le coût fixe d'un fsync domine : rien à dire du débit du SSD
+_MIN_SAMPLE_BYTES = 1024 * 1024
+
+
+class AdmissionError(Exception):
+    status_code = 503
+
+    def __init__(self, detail: str, headers: dict = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.headers = headers or {}
+
+
+class InsufficientStorage(AdmissionError):
+    status_code = 507
+
+
+class DeviceSaturated(AdmissionError):
+    status_code = 503
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+class AdmissionController:
+    def __init__(self, path: Path, min_free_bytes: int, window_seconds: float, min_samples: int,
+                 max_seconds_per_mb: float, retry_after: int, progress_bytes: int):
+        self.path = path
+        self.min_free_bytes = min_free_bytes
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.max_seconds_per_mb = max_seconds_per_mb
+        self.retry_after = retry_after
+        self.progress_bytes = progress_bytes
+        self.pid = os.getpid()
+        self._ids = itertools.count(1)
+        self._samples = deque()  # (monotonic, octets, secondes)
+        self._lock = threading.Lock()
+        # réservations de ce worker : id -> [octets réservés, octets écrits déclarés]
+        self._local = {}
+        self.rejected = {"no_space": 0, "saturated": 0}
+
+    # -- place disque ----------------------------------------------------
+
+    def disk_usage(self) -> dict:
+        self.path.mkdir(parents=True, exist_ok=True)
+        st = os.statvfs(self.path)
+        return {"total": st.f_blocks * st.f_frsize, "free": st.f_bavail * st.f_frsize}
+
+    def acquire(self, nbytes: int) -> str:
+        """
+        Réserve `nbytes` sur le disque ou lève InsufficientStorage. Le test
+        "libre - réservé >= demandé" et l'insertion sont une seule requête :
+        deux workers ne peuvent pas réserver la même place.
+        Retourne l'id de la réservation, à passer à release().
+        """
+        nbytes = max(int(nbytes), 0)
+        budget = self.disk_usage()["free"] - self.min_free_bytes
+        reservation_id = f"{self.pid}:{next(self._ids)}"
+        reserved = select(func.coalesce(func.sum(write_reservations.c.bytes), 0)).scalar_subquery()
+        with engine.begin() as conn:
+            result = conn.execute(
+                insert(write_reservations).from_select(
+                    ["id", "pid", "owner", "bytes", "created_at"],
+                    select(
+                        literal(reservation_id), literal(self.pid), literal(instance_token()),
+                        literal(nbytes), literal(time.time()),
+                    ).where(reserved + nbytes <= budget),
+                )
+            )
+        if result.rowcount != 1:
+            with self._lock:
+                self.rejected["no_space"] += 1
+            raise InsufficientStorage("Espace disque insuffisant pour cet envoi")
+        with self._lock:
+            self._local[reservation_id] = [nbytes, 0]
+        return reservation_id
+
+    def checkpoint(self, fileobj, reservation_id: str, written: int, final: bool = False):
+        """
+        À appeler après chaque écriture de `fileobj` (`written` octets au
+        total). Toutes les `progress_bytes` octets (et à la fin, `final`) :
+        os.fsync chronométré, qui donne un échantillon de latence du SSD, puis
+        réservation ramenée à ce qui reste à écrire.
+        """
+        with self._lock:
+            entry = self._local.get(reservation_id)
+            if entry is None or (written - entry[1] < self.progress_bytes and not final):
+                return
+            pending = written - entry[1]
+            entry[1] = written
+            remaining = max(entry[0] - written, 0)
+        fileobj.flush()
+        started = time.perf_counter()
+        os.fsync(fileobj.fileno())
+        self.observe_write(pending, time.perf_counter() - started)
+        with engine.begin() as conn:
+            conn.execute(
+                update(write_reservations)
+                .where(write_reservations.c.id == reservation_id)
+                .values(bytes=remaining)
+            )
+
+    def release(self, reservation_id: str):
+        with self._lock:
+            self._local.pop(reservation_id, None)
+        with engine.begin() as conn:
+            conn.execute(delete(write_reservations).where(write_reservations.c.id == reservation_id))
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        """acquire() / release() autour d'un bloc ; donne l'id de la réservation."""
+        reservation_id = self.acquire(nbytes)
+        try:
+            yield reservation_id
+        finally:
+            self.release(reservation_id)
+
+    def reserved_total(self) -> int:
+        with engine.connect() as conn:
+            return conn.execute(select(func.coalesce(func.sum(write_reservations.c.bytes), 0))).scalar()
+
+    # -- latence d'écriture ----------------------------------------------
+
+    def observe_write(self, nbytes: int, seconds: float):
+        """`nbytes` mis sur le disque en `seconds` (fsync, voir checkpoint())."""
+        if nbytes < _MIN_SAMPLE_BYTES:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, nbytes, seconds))
+            self._trim(now)
+
+    def _trim(self, now: float):
+        while self._samples and self._samples[0][0] < now - self.window_seconds:
+            self._samples.popleft()
+
+    def _latencies(self) -> list:
+        with self._lock:
+            self._trim(time.monotonic())
+            return [seconds * _MB / nbytes for _, nbytes, seconds in self._samples]
+
+    def saturated(self) -> bool:
+        latencies = self._latencies()
+        if len(latencies) < self.min_samples:
+            return False
+        return _percentile(latencies, 0.9) > self.max_seconds_per_mb
+
+    def check_latency(self):
+        if self.saturated():
+            with self._lock:
+                self.rejected["saturated"] += 1
+            raise DeviceSaturated(
+                "Disque saturé, réessayez plus tard",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+    # -- stats -----------------------------------------------------------
+
+    def stats(self) -> dict:
+        latencies = self._latencies()
+        with self._lock:
+            written = sum(nbytes for _, nbytes, _ in self._samples)
+            busy = sum(seconds for _, _, seconds in self._samples)
+            local_reserved = sum(max(nbytes - written, 0) for nbytes, written in self._local.values())
+            rejected = dict(self.rejected)
+        usage = self.disk_usage()
+        return {
+            "disk": {
+                **usage,
+                "reserved": self.reserved_total(),
+                "reserved_local": local_reserved,
+                "min_free_bytes": self.min_free_bytes,
+            },
+            "writes": {
+                "window_seconds": self.window_seconds,
+                "samples": len(latencies),
+                "seconds_per_mb_p50": _percentile(latencies, 0.5),
+                "seconds_per_mb_p90": _percentile(latencies, 0.9),
+                "max_seconds_per_mb": self.max_seconds_per_mb,
+                "mb_per_sec_while_writing": round(written / _MB / busy, 2) if busy else None,
+                "saturated": self.saturated(),
+            },
+            "rejected": rejected,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_admission() -> AdmissionController:
+    conf = get_section("admission", DEFAULTS)
+    return AdmissionController(
+        DATA_DIR,
+        min_free_bytes=int(conf["min_free_bytes"]),
+        window_seconds=float(conf["window_seconds"]),
+        min_samples=int(conf["min_samples"]),
+        max_seconds_per_mb=float(conf["max_seconds_per_mb"]),
+        retry_after=int(conf["retry_after"]),
+        progress_bytes=int(conf["progress_bytes"]),
+    )
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI : pour les POST sur `write_paths`, vérifie la latence
+    du SSD et réserve Content-Length avant que le corps ne soit lu.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        conf = get_section("admission", DEFAULTS)
+        self.write_paths = [re.compile(p) for p in conf["write_paths"]]
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not any(p.match(scope["path"]) for p in self.write_paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length")
+        if length is None or not length.isdigit():
+            response = JSONResponse({"detail": "Content-Length obligatoire"}, status_code=411)
+            await response(scope, receive, send)
+            return
+
+        admission = get_admission()
+        nbytes = int(length)
+        try:
+            admission.check_latency()
+            # la réservation touche SQLite : hors de la boucle asyncio
+            reservation_id = await run_in_threadpool(admission.acquire, nbytes)
+        except AdmissionError as exc:
+            response = JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+            await response(scope, receive, send)
+            return
+        scope.setdefault("state", {})["write_reservation"] = reservation_id
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await run_in_threadpool(admission.release, reservation_id)
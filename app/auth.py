@@ -1,18 +1,28 @@
-from passlib.context import CryptContext
+from functools import lru_cache
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import uuid
 
 from . import models
+from .cache import user_cache
+
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """
+    PBKDF2 sécurisé.
+    passlib n'est importé qu'au premier hash / vérification, pas au démarrage
+    du serveur (le /health doit répondre le plus vite possible).
+    """
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
-# PBKDF2 sécurisé
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 # ---------------------------------------------------------
@@ -23,11 +33,39 @@ def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
+def get_user_record(db: Session, username: str):
+    """
+    Fiche utilisateur en lecture seule (dict), servie par le cache "users".
+    Pour modifier l'utilisateur, utiliser get_user_by_username() puis
+    cache.invalidate_user() après le commit.
+    """
+    def load():
+        user = get_user_by_username(db, username)
+        if not user:
+            return None
+        return {
+            "id": user.id,
+            "username": user.username,
+            "password_hash": user.password_hash,
+            "role": user.role,
+            "settings": user.settings,
+        }
+
+    if not username:
+        return None
+    return user_cache().get_or_load(username, load)
+
+
+def get_user_role(db: Session, username: str):
+    record = get_user_record(db, username)
+    return record["role"] if record else None
+
+
 def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+    user = get_user_record(db, username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not verify_password(password, user["password_hash"]):
         return None
     return user
 
@@ -0,0 +1,203 @@
+"""
+Cache mémoire (read-through) pour les requêtes répétées :
+  - "users"       : fiche utilisateur (username, rôle, settings, hash du mdp)
+  - "listings"    : pages du listing du workspace
+  - "files"       : chemin / nom d'un fichier par id (téléchargements publics)
+  - "share_links" : état (révoqué ou non) des liens de partage
+
+Chaque cache est un LRU borné en mémoire (taille approximative des
+valeurs). Les entrées sont invalidées explicitement après les commits qui
+les modifient (upload, settings, mot de passe...), via invalidate_user()
+invalidate_listings() et invalidate_share_link(). Le chemin et le nom
+d'un fichier ne changent pas après l'upload : "files" n'est borné que par
+le LRU.
+
+Avec plusieurs workers, chaque invalidation est aussi publiée dans SQLite
+(shared_state.py) et appliquée par les autres processus au plus tard
+`shared_state.poll_interval` secondes après.
+
+Les valeurs mises en cache sont des dict / list "simples", jamais des objets
+SQLAlchemy (ils sont liés à une session).
+"""
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from .config import get_section
+from .shared_state import get_invalidation_bus
+
+DEFAULTS = {
+    "users_max_bytes": 256 * 1024,
+    "listings_max_bytes": 1024 * 1024,
+    "files_max_bytes": 256 * 1024,
+    "share_links_max_bytes": 64 * 1024,
+}
+
+
+def _approx_size(value) -> int:
+    # estimation simple et rapide, suffisante pour borner la mémoire
+    return len(repr(value)) + 64
+
+
+class LRUCache:
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # incrémentés par invalidate() / clear() : une valeur chargée avant
+        # une invalidation ne doit pas être mise en cache après
+        self._generations = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def generation(self, key) -> tuple:
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, generation: tuple = None):
+        """
+        `generation` (lue avec generation() avant de charger la valeur) :
+        si la clé a été invalidée depuis, la valeur est périmée et ignorée.
+        """
+        size = _approx_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Read-through : `loader()` n'est appelé qu'en cas de miss.
+        Un résultat None n'est pas mis en cache."""
+        value = self.get(key)
+        if value is None:
+            generation = self.generation(key)
+            value = loader()
+            if value is not None:
+                self.set(key, value, generation)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            if self._data:
+                self.invalidations += len(self._data)
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+@lru_cache(maxsize=None)
+def get_caches() -> dict:
+    conf = get_section("cache", DEFAULTS)
+    return {
+        "users": LRUCache("users", conf["users_max_bytes"]),
+        "listings": LRUCache("listings", conf["listings_max_bytes"]),
+        "files": LRUCache("files", conf["files_max_bytes"]),
+        "share_links": LRUCache("share_links", conf["share_links_max_bytes"]),
+    }
+
+
+# caches dont les clés sont des id (le journal SQLite stocke du texte)
+_INT_KEYS = {"files", "share_links"}
+
+
+def _apply_invalidation(cache: str, key):
+    target = get_caches().get(cache)
+    if target is None:
+        return
+    if key is None:
+        target.clear()
+    elif cache in _INT_KEYS:
+        target.invalidate(int(key))
+    else:
+        target.invalidate(key)
+
+
+def _sync():
+    get_invalidation_bus().poll(_apply_invalidation)
+
+
+def user_cache() -> LRUCache:
+    _sync()
+    return get_caches()["users"]
+
+
+def listing_cache() -> LRUCache:
+    _sync()
+    return get_caches()["listings"]
+
+
+def invalidate_user(username: str):
+    get_caches()["users"].invalidate(username)
+    get_invalidation_bus().publish("users", username)
+
+
+def file_cache() -> LRUCache:
+    _sync()
+    return get_caches()["files"]
+
+
+def share_link_cache() -> LRUCache:
+    _sync()
+    return get_caches()["share_links"]
+
+
+def invalidate_listings():
+    get_caches()["listings"].clear()
+    get_invalidation_bus().publish("listings")
+
+
+def invalidate_share_link(link_id: int):
+    get_caches()["share_links"].invalidate(link_id)
+    get_invalidation_bus().publish("share_links", link_id)
+
+
+def cache_stats() -> dict:
+    return {name: c.stats() for name, c in get_caches().items()}
@@ -0,0 +1,559 @@
+"""
+Historique des versions, stocké par chunks dédupliqués.
+
+Chaque version d'un fichier est découpée en chunks "content-defined"
+(hash glissant Gear, coupure quand les bits testés du hash sont nuls) :
+une modification locale ne change que les chunks autour d'elle, les
+autres sont retrouvés à l'identique et ne sont stockés qu'une fois
+(data/chunks/ab/cd/<sha256>).
+
+Le fichier "courant" reste aussi en clair à son chemin habituel : les
+téléchargements et la synchronisation ne passent pas par les chunks.
+
+Rétention (section "versions" de config/settings.json) : au plus
+`keep_last` versions par fichier, aucune plus vieille que `max_age_days`
+(sauf la version courante). Les chunks qui ne sont plus référencés sont
+supprimés après `chunk_grace_seconds` par run_maintenance().
+
+Le découpage est en Python pur (quelques Mo/s sur le Pi) : il est fait
+par la file de tâches (job "store_version", dans un processus séparé, voir
+jobs.py) et les fichiers plus gros que `max_file_bytes` ne sont pas
+versionnés. La rétention / GC est aussi une tâche ("versions_maintenance").
+
+Le fichier en clair peut être remplacé (upload, delta, restauration) avant
+que la tâche ne passe. Chaque contenu à versionner est donc figé par un lien
+dur dans data/pending_versions/ (snapshot()), pris sur le fichier temporaire
+avant son os.replace : la tâche découpe ce lien, jamais le fichier courant,
+puis le supprime. Le contenu écrasé est aussi figé s'il n'a pas encore de
+version (snapshot_previous()).
+
+store_version() et le GC des chunks sont exclusifs (verrou fichier
+data/.versions_gc.lock, partagé pour les versions, exclusif pour le GC) :
+sinon le GC pourrait effacer le fichier d'un chunk qu'une version en cours
+vient de retrouver sur le disque et de ne pas réécrire.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import random
+import secrets
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .config import get_section
+from .database import SessionLocal
+from .jobs import enqueue, job
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+CHUNKS_DIR = DATA_DIR / "chunks"
+PENDING_DIR = DATA_DIR / "pending_versions"
+GC_LOCK_PATH = DATA_DIR / ".versions_gc.lock"
+
+DEFAULTS = {
+    "min_chunk": 64 * 1024,
+    "avg_chunk": 256 * 1024,
+    "max_chunk": 1024 * 1024,
+    "keep_last": 10,
+    "max_age_days": 30,
+    "max_file_bytes": 2 * 1024 ** 3,
+    "prune_interval": 3600,
+    # plus long que le découpage du plus gros fichier versionné sur le Pi
+    "chunk_grace_seconds": 86400,
+}
+
+_READ_SIZE = 4 * 1024 * 1024
+_MASK32 = 0xFFFFFFFF
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    return get_section("versions", DEFAULTS)
+
+
+# ---------------------------------------------------------
+# Découpage content-defined (Gear / FastCDC simplifié)
+# ---------------------------------------------------------
+
+def _gear_table():
+    # table fixe : les mêmes données doivent toujours donner les mêmes coupures
+    rng = random.Random(0x48434421)
+    return [rng.getrandbits(32) for _ in range(256)]
+
+
+_GEAR = _gear_table()
+
+
+def _masks(avg_size: int):
+    bits = max(avg_size.bit_length() - 1, 1)
+    # "normalized chunking" : plus strict avant la taille moyenne, plus souple après
+    # (bits de poids fort : les bits bas du hash Gear dépendent de trop peu d'octets)
+    strict = ((1 << (bits + 1)) - 1) << (31 - bits)
+    loose = ((1 << (bits - 1)) - 1) << (33 - bits)
+    return strict & _MASK32, loose & _MASK32
+
+
+def _cut_point(buf, n: int, min_size: int, avg_size: int, max_size: int) -> int:
+    """Longueur du prochain chunk au début de buf[:n]."""
+    if n <= min_size:
+        return n
+    mask_strict, mask_loose = _masks(avg_size)
+    gear = _GEAR
+    h = 0
+    normal = min(n, avg_size)
+    limit = min(n, max_size)
+    # for sur une tranche : nettement plus rapide qu'un while indexé en Python
+    for i, byte in enumerate(buf[min_size:normal], min_size):
+        h = ((h << 1) + gear[byte]) & _MASK32
+        if not h & mask_strict:
+            return i + 1
+    for i, byte in enumerate(buf[normal:limit], normal):
+        h = ((h << 1) + gear[byte]) & _MASK32
+        if not h & mask_loose:
+            return i + 1
+    return limit
+
+
+def iter_chunks(f, min_size: int, avg_size: int, max_size: int):
+    """Découpe le flux binaire `f` en chunks (bytes)."""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            data = f.read(_READ_SIZE)
+            if data:
+                buf += data
+            else:
+                eof = True
+        if not buf:
+            return
+        cut = _cut_point(buf, len(buf), min_size, avg_size, max_size)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+# ---------------------------------------------------------
+# Stockage des chunks
+# ---------------------------------------------------------
+
+@contextmanager
+def _gc_lock(exclusive: bool = False, blocking: bool = True):
+    """
+    Verrou fichier (entre threads et processus) des chunks : partagé pendant
+    un store_version(), exclusif pendant le GC. Donne False si le verrou
+    n'a pas pu être pris sans attendre (blocking=False).
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    with open(GC_LOCK_PATH, "a") as lock:
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def chunk_path(chunk_hash: str) -> Path:
+    return CHUNKS_DIR / chunk_hash[:2] / chunk_hash[2:4] / chunk_hash
+
+
+def _write_chunk(chunk_hash: str, data: bytes):
+    path = chunk_path(chunk_hash)
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=".chunk-", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def iter_version_bytes(db: Session, version: models.FileVersion):
+    """
+    Contenu d'une version, chunk par chunk (pour un StreamingResponse).
+    La liste des chunks est lue tout de suite : la session DB de la requête
+    est fermée avant que la réponse ne soit streamée.
+    """
+    hashes = [
+        h for (h,) in db.query(models.VersionChunk.chunk_hash)
+        .filter(models.VersionChunk.version_id == version.id)
+        .order_by(models.VersionChunk.seq)
+        .all()
+    ]
+
+    def read_chunks():
+        for chunk_hash in hashes:
+            with open(chunk_path(chunk_hash), "rb") as f:
+                yield f.read()
+
+    return read_chunks()
+
+
+# ---------------------------------------------------------
+# Versions
+# ---------------------------------------------------------
+
+def latest_version(db: Session, file_id: int):
+    return (
+        db.query(models.FileVersion)
+        .filter(models.FileVersion.file_id == file_id)
+        .order_by(models.FileVersion.version_no.desc())
+        .first()
+    )
+
+
+def _new_version(db: Session, db_file: models.File, size: int, sha256: str, username: str):
+    last_no = (
+        db.query(func.max(models.FileVersion.version_no))
+        .filter(models.FileVersion.file_id == db_file.id)
+        .scalar()
+    ) or 0
+    version = models.FileVersion(
+        file_id=db_file.id,
+        version_no=last_no + 1,
+        size=size,
+        sha256=sha256,
+        created_by=username,
+        created_at=datetime.utcnow(),
+    )
+    db.add(version)
+    db.flush()
+    return version
+
+
+def _touch_chunks(db: Session, rows: list):
+    """Déclare les chunks (hash, size) comme utilisés maintenant (protège du GC)."""
+    now = time.time()
+    stmt = sqlite_insert(models.Chunk).values(
+        [{"hash": h, "size": s, "last_used_at": now} for h, s in rows]
+    )
+    db.execute(stmt.on_conflict_do_update(index_elements=["hash"], set_={"last_used_at": now}))
+    db.commit()
+
+
+def _copy_version(db: Session, db_file: models.File, version: models.FileVersion, username: str):
+    """Nouvelle version en tête avec les chunks de `version` (rien n'est recopié)."""
+    hashes = [
+        (h, s) for (h, s) in db.query(models.VersionChunk.chunk_hash, models.Chunk.size)
+        .join(models.Chunk, models.Chunk.hash == models.VersionChunk.chunk_hash)
+        .filter(models.VersionChunk.version_id == version.id)
+        .order_by(models.VersionChunk.seq)
+        .all()
+    ]
+    if hashes:
+        _touch_chunks(db, list(dict.fromkeys(hashes)))
+    new_version = _new_version(db, db_file, version.size, version.sha256, username)
+    db.add_all([
+        models.VersionChunk(version_id=new_version.id, seq=seq, chunk_hash=h)
+        for seq, (h, _) in enumerate(hashes)
+    ])
+    db.commit()
+    db.refresh(new_version)
+    return new_version
+
+
+def store_version(db: Session, db_file: models.File, username: str, source: Path = None,
+                  sha256: str = None, from_version: int = None):
+    """
+    Enregistre le contenu de `source` (par défaut db_file.path) comme
+    nouvelle version de db_file. `sha256` : empreinte de ce contenu si elle
+    est connue ; `from_version` : id d'une version au même contenu, dont les
+    chunks sont repris sans redécouper (restauration).
+    Ne fait rien si le fichier est trop gros ou identique à la dernière version.
+    Retourne la version créée (ou None).
+    """
+    with _gc_lock():
+        return _store_version(db, db_file, username, path=source or Path(db_file.path),
+                              sha256=sha256, from_version=from_version)
+
+
+def _store_version(db: Session, db_file: models.File, username: str, path: Path,
+                   sha256: str, from_version: int):
+    conf = get_settings()
+    last = latest_version(db, db_file.id)
+    if last is not None and sha256 and last.sha256 == sha256:
+        return None
+    if from_version is not None:
+        version = db.query(models.FileVersion).filter(models.FileVersion.id == from_version).first()
+        if version is not None and version.sha256 == sha256:
+            return _copy_version(db, db_file, version, username)
+    size = path.stat().st_size
+    if size > conf["max_file_bytes"]:
+        return None
+
+    digest = hashlib.sha256()
+    entries = []
+    pending = []
+    with open(path, "rb") as f:
+        for data in iter_chunks(f, conf["min_chunk"], conf["avg_chunk"], conf["max_chunk"]):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            digest.update(data)
+            pending.append((chunk_hash, len(data)))
+            # la ligne "chunks" (last_used_at) est écrite avant le fichier :
+            # le GC qui suit ce store_version ne la supprimera pas
+            if len(pending) >= 64:
+                _touch_chunks(db, pending)
+                pending = []
+            _write_chunk(chunk_hash, data)
+            entries.append(chunk_hash)
+    if pending:
+        _touch_chunks(db, pending)
+
+    # deux tâches peuvent figer le même contenu (contenu écrasé avant que sa
+    # propre tâche ne passe) : on revérifie une fois le découpage fini
+    last = latest_version(db, db_file.id)
+    if last is not None and last.sha256 == digest.hexdigest():
+        return None
+    version = _new_version(db, db_file, size, digest.hexdigest(), username)
+    db.add_all([
+        models.VersionChunk(version_id=version.id, seq=seq, chunk_hash=h)
+        for seq, h in enumerate(entries)
+    ])
+    db.commit()
+    db.refresh(version)
+    return version
+
+
+def snapshot(path: Path) -> Path:
+    """
+    Fige le contenu actuel de `path` : lien dur dans PENDING_DIR (même
+    disque), qui garde l'inode même quand `path` est remplacé par os.replace.
+    """
+    PENDING_DIR.mkdir(parents=True, exist_ok=True)
+    link = PENDING_DIR / f"{time.time_ns()}-{secrets.token_hex(4)}"
+    os.link(path, link)
+    return link
+
+
+def snapshot_previous(db: Session, db_file: models.File):
+    """
+    À appeler avant d'écraser db_file.path : si son contenu n'est pas déjà
+    la dernière version (tâche pas encore passée, fichier d'avant
+    l'historique), le fige. Retourne (lien, sha256) ou None.
+    """
+    path = Path(db_file.path)
+    last = latest_version(db, db_file.id)
+    if db_file.sha256 and last is not None and last.sha256 == db_file.sha256:
+        return None
+    try:
+        return snapshot(path), db_file.sha256
+    except FileNotFoundError:
+        return None
+
+
+def restore_version(db: Session, db_file: models.File, version: models.FileVersion) -> Path:
+    """
+    Remet le contenu de `version` comme contenu courant (fichier en clair
+    réécrit atomiquement). Retourne le lien figé du contenu restauré : la
+    nouvelle version en tête est créée par la tâche "store_version"
+    (from_version=version.id), après celle du contenu écrasé.
+    """
+    dest = Path(db_file.path)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(prefix=".restore-", dir=dest.parent)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for data in iter_version_bytes(db, version):
+                out.write(data)
+                digest.update(data)
+            out.flush()
+            os.fsync(out.fileno())
+        if digest.hexdigest() != version.sha256:
+            raise ValueError("Version corrompue (sha256 différent)")
+        link = snapshot(Path(tmp_name))
+        os.replace(tmp_name, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+    db_file.size = version.size
+    db_file.sha256 = version.sha256
+    return link
+
+
+# ---------------------------------------------------------
+# Rétention et GC
+# ---------------------------------------------------------
+
+def prune_versions(db: Session, keep_last: int, max_age_days: float) -> int:
+    """Supprime les versions hors rétention (jamais la plus récente d'un fichier)."""
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    removed = 0
+    file_ids = [fid for (fid,) in db.query(models.FileVersion.file_id).distinct().all()]
+    for file_id in file_ids:
+        versions = (
+            db.query(models.FileVersion)
+            .filter(models.FileVersion.file_id == file_id)
+            .order_by(models.FileVersion.version_no.desc())
+            .all()
+        )
+        for rank, version in enumerate(versions):
+            if rank == 0:
+                continue
+            if rank >= keep_last or (version.created_at and version.created_at < cutoff):
+                db.query(models.VersionChunk).filter(
+                    models.VersionChunk.version_id == version.id
+                ).delete(synchronize_session=False)
+                db.delete(version)
+                removed += 1
+        db.commit()
+    return removed
+
+
+def gc_chunks(db: Session, grace_seconds: float) -> int:
+    """
+    Supprime les chunks non référencés et inutilisés depuis `grace_seconds`.
+    Les deux conditions sont dans le DELETE lui-même et seuls les fichiers
+    des lignes réellement supprimées (RETURNING) sont effacés du disque.
+    À appeler sous _gc_lock(exclusive=True) : aucun store_version ne doit
+    pouvoir reprendre un chunk entre le DELETE et l'effacement du fichier.
+    """
+    referenced = select(models.VersionChunk.chunk_hash)
+    orphan = and_(
+        models.Chunk.last_used_at < time.time() - grace_seconds,
+        models.Chunk.hash.not_in(referenced),
+    )
+    removed = 0
+    while True:
+        batch = select(models.Chunk.hash).where(orphan).limit(500)
+        deleted = db.execute(
+            delete(models.Chunk)
+            .where(models.Chunk.hash.in_(batch), orphan)
+            .returning(models.Chunk.hash)
+        ).scalars().all()
+        db.commit()
+        if not deleted:
+            return removed
+        for chunk_hash in deleted:
+            try:
+                chunk_path(chunk_hash).unlink()
+            except FileNotFoundError:
+                pass
+        removed += len(deleted)
+
+
+def prune_pending(max_age_seconds: float) -> int:
+    """Supprime les liens de PENDING_DIR plus vieux que `max_age_seconds` (horodatés dans le nom)."""
+    if not PENDING_DIR.exists():
+        return 0
+    cutoff = time.time_ns() - int(max_age_seconds * 1e9)
+    removed = 0
+    for link in PENDING_DIR.iterdir():
+        stamp = link.name.partition("-")[0]
+        if stamp.isdigit() and int(stamp) < cutoff:
+            link.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def run_maintenance(db: Session) -> dict:
+    """
+    Rétention + GC. Avec plusieurs workers, un seul à la fois fait le
+    travail (verrou fichier non bloquant) ; la maintenance est aussi sautée
+    tant qu'un store_version est en cours (reprise au tour suivant).
+    """
+    conf = get_settings()
+    with _gc_lock(exclusive=True, blocking=False) as locked:
+        if not locked:
+            return {"skipped": True}
+        pruned = prune_versions(db, int(conf["keep_last"]), float(conf["max_age_days"]))
+        collected = gc_chunks(db, float(conf["chunk_grace_seconds"]))
+        # liens de tâches abandonnées (échecs répétés) : une version de
+        # cet âge serait de toute façon supprimée par la rétention
+        stale = prune_pending(float(conf["max_age_days"]) * 86400)
+    return {"pruned_versions": pruned, "deleted_chunks": collected, "stale_snapshots": stale}
+
+
+# ---------------------------------------------------------
+# Tâches de fond (voir jobs.py)
+# ---------------------------------------------------------
+
+@job("store_version", kind="process", concurrency=1, max_attempts=3)
+def store_version_job(payload: dict):
+    """
+    Version d'un contenu figé par snapshot() (upload, delta, contenu écrasé,
+    restauration). Le lien est supprimé une fois la version enregistrée ; il
+    est gardé si la tâche échoue, pour la nouvelle tentative.
+    """
+    source = Path(payload["path"])
+    db = SessionLocal()
+    try:
+        db_file = db.query(models.File).filter(models.File.id == payload["file_id"]).first()
+        if db_file and not db_file.is_deleted:
+            store_version(db, db_file, payload.get("username"), source=source,
+                          sha256=payload.get("sha256"), from_version=payload.get("from_version"))
+    finally:
+        db.close()
+    source.unlink(missing_ok=True)
+
+
+def enqueue_store_version(db_file: models.File, username: str, source: Path,
+                          sha256: str = None, from_version: int = None):
+    """
+    À appeler après le commit qui a changé le contenu de db_file, avec le
+    lien figé du contenu à versionner (snapshot() / snapshot_previous()).
+    Les tâches d'un même fichier forment une série (serial_key) : elles
+    passent dans l'ordre de mise en file, même si l'une est reprogrammée
+    après une erreur.
+    """
+    return enqueue("store_version", {
+        "file_id": db_file.id,
+        "path": str(source),
+        "sha256": sha256,
+        "from_version": from_version,
+        "username": username,
+    }, serial_key=f"file:{db_file.id}")
+
+
+@job("versions_maintenance", kind="thread", max_attempts=1, priority=-10)
+def maintenance_job(payload: dict):
+    db = SessionLocal()
+    try:
+        logger.info("Maintenance des versions : %s", run_maintenance(db))
+    finally:
+        db.close()
+
+
+async def maintenance_loop():
+    """
+    Tâche de fond lancée par le lifespan : met en file la rétention + GC
+    toutes les `prune_interval` secondes (une seule à la fois pour tous
+    les workers).
+    """
+    interval = float(get_settings()["prune_interval"])
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(enqueue, "versions_maintenance", unique=True)
+        except Exception:  # on réessaiera au prochain tour
+            logger.exception("Mise en file de la maintenance des versions échouée")
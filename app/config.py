@@ -0,0 +1,25 @@
+"""
+Lecture de config/settings.json.
+Chaque module demande sa section avec ses valeurs par défaut :
+    get_section("transfers", {"chunk_size": 262144})
+"""
+import json
+from functools import lru_cache
+from pathlib import Path
+
+SETTINGS_FILE = Path(__file__).resolve().parent.parent / "config" / "settings.json"
+
+
+@lru_cache(maxsize=None)
+def load_settings() -> dict:
+    try:
+        return json.loads(SETTINGS_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def get_section(name: str, defaults: dict) -> dict:
+    """Section `name` du fichier de config, complétée par `defaults`."""
+    section = dict(defaults)
+    section.update(load_settings().get(name) or {})
+    return section
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # URL de la base SQLite (fichier home_container.db à la racine du projet)
@@ -10,6 +11,21 @@ engine = create_engine(
     connect_args={"check_same_thread": False}  # nécessaire pour SQLite + threads
 )
 
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Réglages SQLite pour plusieurs workers (processus) sur la même base :
+    - WAL : les lectures ne bloquent pas l'écriture en cours ;
+    - busy_timeout : un writer attend le verrou au lieu d'échouer
+      immédiatement avec "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 # Base de tous les modèles SQLAlchemy
 Base = declarative_base()
 
@@ -17,6 +33,29 @@ Base = declarative_base()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def add_missing_columns(bind=engine):
+    """
+    Mini-migration : create_all() ne modifie pas une table existante.
+    On ajoute ici les colonnes (nullable) apparues dans les modèles depuis
+    la création de la base, avec leurs index.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c["name"] for c in inspector.get_columns(table.name)}
+            missing = [c for c in table.columns if c.name not in present]
+            for column in missing:
+                col_type = column.type.compile(dialect=bind.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}')
+            missing_names = {c.name for c in missing}
+            for index in table.indexes:
+                if any(c.name in missing_names for c in index.columns):
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
 # Dépendance FastAPI : fournit une session DB à chaque requête
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,430 @@
+"""
+File d'attente de tâches de fond, persistée dans SQLite (table "jobs").
+
+Les traitements lourds (découpage des versions en chunks, rétention / GC...)
+ne sont plus faits dans les requêtes : le handler appelle enqueue() après
+son commit et répond tout de suite ; un JobRunner, lancé par le lifespan
+de chaque worker, exécute les tâches :
+
+- type "thread"  : pool de threads (I/O, accès SQLite) ;
+- type "process" : pool de processus (calcul Python pur, qui bloquerait
+  le GIL du worker).
+
+Chaque type est déclaré avec le décorateur @job(...) dans le module qui
+l'implémente (la fonction reçoit le payload, un dict JSON). Priorité : le
+plus grand passe d'abord. Concurrence par type : le nombre de tâches
+"running" est compté dans l'UPDATE qui prend la tâche, la limite est donc
+globale à tous les workers. Une tâche en erreur est reprogrammée avec un
+délai croissant (retry_backoff * 2^(essai-1)) jusqu'à max_attempts.
+
+Ordre : enqueue(..., serial_key="file:12") range la tâche dans une série ;
+elle n'est prise que lorsque aucune tâche plus ancienne de la même série
+n'est en attente ou en cours, même reprogrammée après une erreur.
+
+Une tâche "running" dont le worker est mort (crash, redémarrage) est remise
+en file au démarrage suivant (requeue_orphans). Le worker est reconnu par
+son jeton d'instance (shared_state.instance_token) et non par son pid, qui
+peut avoir été réattribué après un redémarrage du Pi.
+
+Section "jobs" de config/settings.json ; `concurrency` surcharge la limite
+déclarée pour un type ({"store_version": 2}).
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from sqlalchemy import and_, delete, exists, func, insert, select, update
+from sqlalchemy.orm import aliased
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .config import get_section
+from .database import engine
+from .shared_state import get_invalidation_bus, instance_alive, instance_token
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "threads": 2,
+    "processes": 1,
+    "poll_interval": 1.0,
+    "retry_backoff": 5,
+    "keep_finished_seconds": 24 * 3600,
+    "stats_window": 3600,
+    "concurrency": {},
+}
+
+Job = models.Job
+
+
+class JobType:
+    def __init__(self, name: str, func, kind: str, concurrency: int, max_attempts: int, priority: int):
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.priority = priority
+
+
+JOB_TYPES = {}
+
+
+def job(name: str, kind: str = "thread", concurrency: int = 1, max_attempts: int = 3, priority: int = 0):
+    """
+    Déclare une fonction comme type de tâche. Pour kind="process", la
+    fonction doit être définie au niveau d'un module (elle est retrouvée par
+    son nom dans le processus fils) et ouvrir sa propre session DB.
+    """
+    if kind not in ("thread", "process"):
+        raise ValueError(f"kind invalide : {kind}")
+
+    def decorator(func):
+        JOB_TYPES[name] = JobType(name, func, kind, concurrency, max_attempts, priority)
+        return func
+
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    return get_section("jobs", DEFAULTS)
+
+
+def _concurrency(job_type: JobType) -> int:
+    return int(get_settings()["concurrency"].get(job_type.name, job_type.concurrency))
+
+
+def enqueue(name: str, payload: dict = None, priority: int = None, delay: float = 0,
+            unique: bool = False, serial_key: str = None):
+    """
+    Ajoute une tâche (transaction propre, à appeler après le commit de la
+    requête). unique=True : rien n'est ajouté si une tâche du même type est
+    déjà en attente ou en cours. serial_key : voir plus haut.
+    Retourne l'id de la tâche (ou None).
+    """
+    job_type = JOB_TYPES[name]
+    now = time.time()
+    values = {
+        "type": name,
+        "payload": json.dumps(payload or {}),
+        "priority": job_type.priority if priority is None else priority,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": job_type.max_attempts,
+        "run_after": now + delay,
+        "created_at": now,
+        "serial_key": serial_key,
+    }
+    with engine.begin() as conn:
+        if unique:
+            pending = conn.execute(
+                select(Job.id).where(Job.type == name, Job.status.in_(("queued", "running"))).limit(1)
+            ).scalar()
+            if pending is not None:
+                return None
+        job_id = conn.execute(insert(Job).values(**values)).inserted_primary_key[0]
+    get_job_runner().notify()
+    return job_id
+
+
+def requeue_orphans() -> int:
+    """Remet en file les tâches "running" de workers qui n'existent plus."""
+    with engine.begin() as conn:
+        owners = conn.execute(
+            select(Job.worker_owner).where(Job.status == "running").distinct()
+        ).scalars().all()
+        dead = [owner for owner in owners if not instance_alive(owner)]
+        if not dead:
+            return 0
+        result = conn.execute(
+            update(Job)
+            .where(Job.status == "running", Job.worker_owner.in_(dead) | Job.worker_owner.is_(None))
+            .values(status="queued", worker_pid=None, worker_owner=None, run_after=time.time())
+        )
+        return result.rowcount
+
+
+def _execute(func, payload: dict):
+    # exécuté dans un thread du pool ou dans un processus fils : on ne
+    # remonte que la trace (str), toujours sérialisable
+    try:
+        func(payload)
+    except Exception:
+        return traceback.format_exc(limit=5)
+    return None
+
+
+class JobRunner:
+    """Exécute les tâches de la file dans ce worker."""
+
+    def __init__(self, threads: int, processes: int, poll_interval: float, retry_backoff: float,
+                 keep_finished_seconds: float):
+        self.threads = threads
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.keep_finished_seconds = keep_finished_seconds
+        self.pid = os.getpid()
+        self.owner = instance_token()
+        self._busy = {"thread": 0, "process": 0}
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._process_pool = None
+        self._loop = None
+        self._wake = None
+        self._last_prune = 0.0
+
+    def _capacity(self, kind: str) -> int:
+        return self.threads if kind == "thread" else self.processes
+
+    def notify(self):
+        """Réveille la boucle (nouvelle tâche, tâche terminée). Thread-safe."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # -- prise des tâches ------------------------------------------------
+
+    def _claim(self, conn, row, job_type: JobType) -> bool:
+        running = (
+            select(func.count()).select_from(Job)
+            .where(Job.type == row.type, Job.status == "running")
+            .scalar_subquery()
+        )
+        stmt = update(Job).where(Job.id == row.id, Job.status == "queued", running < _concurrency(job_type))
+        if row.serial_key is not None:
+            earlier = aliased(Job)
+            stmt = stmt.where(~exists().where(
+                earlier.serial_key == row.serial_key,
+                earlier.id < row.id,
+                earlier.status.in_(("queued", "running")),
+            ))
+        result = conn.execute(
+            stmt
+            .values(status="running", started_at=time.time(), worker_pid=self.pid,
+                    worker_owner=self.owner, attempts=Job.attempts + 1)
+        )
+        return result.rowcount == 1
+
+    def dispatch(self) -> int:
+        """Prend autant de tâches que les pools locaux peuvent en exécuter."""
+        started = 0
+        with self._lock:
+            free = {kind: self._capacity(kind) - busy for kind, busy in self._busy.items()}
+        kinds = [kind for kind, n in free.items() if n > 0]
+        names = [t.name for t in JOB_TYPES.values() if t.kind in kinds]
+        if not names:
+            return 0
+        now = time.time()
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(Job.id, Job.type, Job.payload, Job.serial_key)
+                .where(Job.status == "queued", Job.run_after <= now, Job.type.in_(names))
+                .order_by(Job.priority.desc(), Job.id)
+                .limit(sum(free[k] for k in kinds) * 4)
+            ).all()
+        for row in rows:
+            job_type = JOB_TYPES[row.type]
+            if free[job_type.kind] <= 0:
+                continue
+            with engine.begin() as conn:
+                if not self._claim(conn, row, job_type):
+                    continue
+            free[job_type.kind] -= 1
+            self._submit(row.id, job_type, json.loads(row.payload))
+            started += 1
+        return started
+
+    def _submit(self, job_id: int, job_type: JobType, payload: dict):
+        with self._lock:
+            self._busy[job_type.kind] += 1
+        try:
+            if job_type.kind == "thread":
+                future = self._thread_pool.submit(_execute, job_type.func, payload)
+            else:
+                future = self._process_pool.submit(_execute, job_type.func, payload)
+        except BrokenProcessPool as exc:
+            # un processus fils est mort (mémoire...) : le pool est inutilisable,
+            # on le recrée pour les tâches suivantes
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = self._new_process_pool()
+            with self._lock:
+                self._busy[job_type.kind] -= 1
+            self.finish(job_id, repr(exc))
+            return
+        future.add_done_callback(lambda f: self._done(job_id, job_type, f))
+
+    # -- fin des tâches --------------------------------------------------
+
+    def _done(self, job_id: int, job_type: JobType, future):
+        with self._lock:
+            self._busy[job_type.kind] -= 1
+        if future.cancelled():
+            error = "annulée (arrêt du serveur)"
+        else:
+            try:
+                error = future.result()
+            except Exception as exc:  # processus fils mort, payload non sérialisable...
+                error = repr(exc)
+        try:
+            self.finish(job_id, error)
+        except Exception:
+            logger.exception("Impossible d'enregistrer la fin de la tâche %s", job_id)
+        self.notify()
+
+    def finish(self, job_id: int, error: str = None):
+        now = time.time()
+        with engine.begin() as conn:
+            if error is None:
+                conn.execute(update(Job).where(Job.id == job_id)
+                             .values(status="done", finished_at=now, last_error=None))
+                return
+            logger.warning("Tâche %s en erreur : %s", job_id, error)
+            attempts, max_attempts = conn.execute(
+                select(Job.attempts, Job.max_attempts).where(Job.id == job_id)
+            ).one()
+            if attempts < max_attempts:
+                conn.execute(update(Job).where(Job.id == job_id).values(
+                    status="queued", worker_pid=None, worker_owner=None, last_error=error,
+                    run_after=now + self.retry_backoff * 2 ** (attempts - 1),
+                ))
+            else:
+                conn.execute(update(Job).where(Job.id == job_id).values(
+                    status="failed", finished_at=now, last_error=error,
+                ))
+
+    def prune(self):
+        """
+        Oublie les tâches terminées depuis plus de keep_finished_seconds.
+        Purge au passage les invalidations de cache expirées (shared_state.py).
+        """
+        with engine.begin() as conn:
+            conn.execute(delete(Job).where(
+                Job.status.in_(("done", "failed")),
+                Job.finished_at < time.time() - self.keep_finished_seconds,
+            ))
+        get_invalidation_bus().prune()
+
+    # -- boucle ----------------------------------------------------------
+
+    def _new_process_pool(self):
+        # "spawn" : pas de fork d'un worker qui a déjà des threads
+        return ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+
+    async def run(self):
+        """Tâche de fond lancée par le lifespan."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._thread_pool = ThreadPoolExecutor(self.threads, thread_name_prefix="job")
+        if self.processes > 0:
+            self._process_pool = self._new_process_pool()
+        try:
+            while True:
+                try:
+                    await run_in_threadpool(self.dispatch)
+                    if time.monotonic() - self._last_prune > 3600:
+                        self._last_prune = time.monotonic()
+                        await run_in_threadpool(self.prune)
+                except Exception:
+                    logger.exception("File de tâches : erreur de la boucle")
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            self._loop = None
+            # les tâches en cours finissent (ou seront remises en file au
+            # prochain démarrage), celles pas encore commencées sont annulées
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def local_stats(self) -> dict:
+        with self._lock:
+            busy = dict(self._busy)
+        return {
+            "pid": self.pid,
+            "threads": {"busy": busy["thread"], "size": self.threads},
+            "processes": {"busy": busy["process"], "size": self.processes},
+        }
+
+
+@lru_cache(maxsize=None)
+def get_job_runner() -> JobRunner:
+    conf = get_settings()
+    return JobRunner(
+        threads=int(conf["threads"]),
+        processes=int(conf["processes"]),
+        poll_interval=float(conf["poll_interval"]),
+        retry_backoff=float(conf["retry_backoff"]),
+        keep_finished_seconds=float(conf["keep_finished_seconds"]),
+    )
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def queue_stats() -> dict:
+    """
+    Profondeur de la file par type / statut, et latences sur les
+    `stats_window` dernières secondes : attente (création -> début) et
+    exécution (début -> fin).
+    """
+    window = float(get_settings()["stats_window"])
+    now = time.time()
+    with engine.connect() as conn:
+        counts = conn.execute(
+            select(Job.type, Job.status, func.count()).group_by(Job.type, Job.status)
+        ).all()
+        oldest = dict(conn.execute(
+            select(Job.type, func.min(Job.created_at)).where(Job.status == "queued").group_by(Job.type)
+        ).all())
+        finished = conn.execute(
+            select(Job.type, Job.created_at, Job.started_at, Job.finished_at)
+            .where(and_(Job.status == "done", Job.finished_at >= now - window))
+        ).all()
+
+    types = {}
+    for name in set(JOB_TYPES) | {row.type for row in counts}:
+        job_type = JOB_TYPES.get(name)
+        types[name] = {
+            "kind": job_type.kind if job_type else None,
+            "concurrency": _concurrency(job_type) if job_type else None,
+            "queued": 0, "running": 0, "done": 0, "failed": 0,
+            "oldest_queued_seconds": round(now - oldest[name], 3) if name in oldest else None,
+        }
+    for name, status, count in counts:
+        types[name][status] = count
+
+    for name, stats in types.items():
+        rows = [r for r in finished if r.type == name]
+        waits = [r.started_at - r.created_at for r in rows]
+        runs = [r.finished_at - r.started_at for r in rows]
+        stats["latency"] = {
+            "count": len(rows),
+            "wait_p50": _percentile(waits, 0.5),
+            "wait_p95": _percentile(waits, 0.95),
+            "run_p50": _percentile(runs, 0.5),
+            "run_p95": _percentile(runs, 0.95),
+        }
+
+    return {
+        "depth": sum(s["queued"] for s in types.values()),
+        "running": sum(s["running"] for s in types.values()),
+        "window_seconds": window,
+        "types": types,
+        "worker": get_job_runner().local_stats(),
+    }
@@ -1,26 +1,96 @@
+import asyncio
+import fcntl
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-
-from .database import Base, engine
-from . import models
-from .routes_workspace import router as workspace_router
-from .routes_container import router as container_router
-from .routes_admin import router as admin_router
-from .routes_auth import router as auth_router
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 
 
 def init_db():
-    models
-    Base.metadata.create_all(bind=engine)
+    # Import des modèles pour que SQLAlchemy connaisse les tables
+    from . import models, shared_state  # noqa: F401
+    from .database import Base, engine, add_missing_columns
+    from .activity import init_activity_db
+    from .sync import backfill_change_seq
+
+    # Avec plusieurs workers, chacun passe ici au démarrage : un verrou
+    # fichier évite deux "CREATE TABLE" simultanés.
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(DATA_DIR / ".init_db.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            Base.metadata.create_all(bind=engine)
+            shared_state.migrate(engine)
+            add_missing_columns(engine)
+            backfill_change_seq(engine)
+            init_activity_db()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Démarrage / arrêt du serveur.
+    Tout ce qui touche au disque (SQLite, dossiers data/) est fait ici et
+    pas à l'import de app.main : l'import reste rapide et sans effet de bord.
+    """
+    from .chunkstore import maintenance_loop
+    from .jobs import get_job_runner, requeue_orphans
+    from .profiling import get_slow_request_tracker
+    from .routes_workspace import ensure_workspace_dir
+    from .shared_state import startup_cleanup
+    from .sharing import flush_loop
+    from .activity import flush_loop as activity_flush_loop
+
+    init_db()
+    ensure_workspace_dir()
+    startup_cleanup()
+    requeue_orphans()
+    get_slow_request_tracker().start()
+    tasks = [
+        asyncio.create_task(get_job_runner().run()),
+        asyncio.create_task(maintenance_loop()),
+        asyncio.create_task(flush_loop()),
+        asyncio.create_task(activity_flush_loop()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    get_slow_request_tracker().stop()
 
 
-def create_app() -> FastAPI:
-    app = FastAPI(title="HOME CONTAINER DRIVE")
+def create_app():
+    """
+    Fabrique de l'application : uvicorn --factory app.main:create_app.
+    FastAPI, SQLAlchemy et les routeurs ne sont importés qu'ici, pour que
+    "import app.main" seul ne charge rien (voir scripts/startup_report.py).
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import HTMLResponse
 
+    from .routes_workspace import router as workspace_router
+    from .routes_container import router as container_router
+    from .routes_admin import router as admin_router
+    from .routes_auth import router as auth_router
+    from .routes_sync import router as sync_router
+    from .routes_share import router as share_router, public_router as share_public_router
+    from .static_assets import IndexPage, PrecompressedStaticFiles
+    from .admission import AdmissionMiddleware
+    from .profiling import SlowRequestMiddleware
+    from .transfers import PacedUploadMiddleware
+
+    app = FastAPI(title="HOME CONTAINER DRIVE", lifespan=lifespan)
+
+    # corps des uploads lu au débit du scheduler (voir transfers.py)
+    app.add_middleware(PacedUploadMiddleware)
+    # place disque / SSD saturé : refus des uploads avant lecture du corps
+    # (ajouté avant CORS pour que les refus aient aussi les en-têtes CORS)
+    app.add_middleware(AdmissionMiddleware)
+    # chronométrage + journal SQL de chaque requête (requêtes lentes)
+    app.add_middleware(SlowRequestMiddleware)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -38,18 +108,33 @@ def create_app() -> FastAPI:
     app.include_router(workspace_router)
     app.include_router(container_router)
     app.include_router(admin_router)
+    app.include_router(sync_router)
+    app.include_router(share_router)
+    app.include_router(share_public_router)
 
-    # Serveur du frontend
+    # Serveur du frontend (variantes précompressées + cache navigateur,
+    # voir scripts/build_static.py)
     static_dir = Path(__file__).resolve().parent.parent / "static"
-    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    app.mount("/static", PrecompressedStaticFiles(directory=static_dir), name="static")
+
+    index_page = IndexPage(static_dir)
 
     @app.get("/", response_class=HTMLResponse)
-    def frontend():
-        index_file = static_dir / "index.html"
-        return index_file.read_text(encoding="utf-8")
+    def frontend(request: Request):
+        return index_page.response(request)
 
     return app
 
 
-init_db()
-app = create_app()
+_app = None
+
+
+def __getattr__(name):
+    # compatibilité "uvicorn app.main:app" / "gunicorn app.main:app" :
+    # l'application n'est construite qu'au premier accès à app.main.app
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -31,3 +31,89 @@ class File(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_deleted = Column(Boolean, default=False)
 
+    # Synchronisation (voir sync.py)
+    size = Column(Integer, nullable=True)
+    sha256 = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    change_seq = Column(Integer, nullable=True, index=True)  # curseur du flux /sync/changes
+
+
+
+class FileVersion(Base):
+    """
+    Version d'un fichier. Le contenu est découpé en chunks (voir chunkstore.py),
+    partagés entre versions : seuls les chunks nouveaux prennent de la place.
+    """
+    __tablename__ = "file_versions"
+    __table_args__ = (UniqueConstraint("file_id", "version_no"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=False, index=True)
+    version_no = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String, nullable=False)
+    created_by = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class VersionChunk(Base):
+    """Position `seq` d'une version -> chunk."""
+    __tablename__ = "version_chunks"
+
+    version_id = Column(Integer, ForeignKey("file_versions.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    chunk_hash = Column(String, ForeignKey("chunks.hash"), nullable=False, index=True)
+
+
+class Chunk(Base):
+    """Chunk stocké une seule fois sur le disque (data/chunks/), par sha256."""
+    __tablename__ = "chunks"
+
+    hash = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    last_used_at = Column(Float, nullable=False, index=True)  # time.time()
+
+
+class ShareLink(Base):
+    """
+    Lien de partage public d'un fichier. Le token (voir sharing.py) contient
+    id, fichier, expiration et plafond de débit, signés par HMAC : il est
+    vérifié sans lire cette table.
+    """
+    __tablename__ = "share_links"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=False, index=True)
+    created_by = Column(String, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(Integer, nullable=False)  # timestamp unix
+    max_bytes_per_sec = Column(Integer, nullable=True)
+    download_count = Column(Integer, nullable=False, default=0)
+    revoked = Column(Boolean, nullable=False, default=False)
+
+
+class Job(Base):
+    """
+    Tâche de fond en file d'attente (voir jobs.py). Les dates sont des
+    time.time() pour mesurer attente et durée d'exécution.
+    status : "queued", "running", "done", "failed"
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_queue", "status", "priority", "run_after"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    type = Column(String, nullable=False, index=True)
+    payload = Column(String, nullable=False, default="{}")  # JSON
+    priority = Column(Integer, nullable=False, default=0)  # le plus grand passe d'abord
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(Float, nullable=False)
+    created_at = Column(Float, nullable=False)
+    started_at = Column(Float, nullable=True)
+    finished_at = Column(Float, nullable=True, index=True)
+    worker_pid = Column(Integer, nullable=True)
+    worker_owner = Column(String, nullable=True)  # shared_state.instance_token()
+    # tâches d'une même série (ex. "file:12") exécutées dans l'ordre des ids
+    serial_key = Column(String, nullable=True, index=True)
+    last_error = Column(String, nullable=True)
@@ -0,0 +1,380 @@
+"""
+Outils de diagnostic pour les admins : "qu'est-ce qui rame sur le Pi ?"
+
+1. Profileur par échantillonnage, à la demande (/admin/profile/start) :
+   un thread relève la pile de tous les threads (sys._current_frames) toutes
+   les `sample_interval` secondes pendant N secondes. Aucun hook sur les
+   appels de fonction : le coût ne dépend pas du code profilé. Le résultat
+   est au format "folded" (une pile par ligne, "a;b;c <nombre>"), lisible
+   par flamegraph.pl ou speedscope.
+
+2. Capture des requêtes lentes (toujours active) : un middleware note le
+   début de chaque requête et y attache un journal SQL (événements
+   SQLAlchemy, via une contextvar). Un thread de surveillance échantillonne
+   les piles dès qu'une requête dépasse la moitié du seuil ; si elle finit
+   au-delà de `slow_request_seconds`, piles + requêtes SQL sont gardées
+   dans un buffer circulaire de `slow_requests_keep` entrées. La durée
+   mesurée va jusqu'à l'envoi des en-têtes de la réponse : le corps d'un
+   téléchargement (cadencé exprès, voir transfers.py) n'est pas compté.
+   Les uploads et deltas (`ignore_paths`) sont ignorés : leur durée est
+   celle du transfert, cadencé lui aussi.
+   Seules les piles des threads de la requête sont relevées : la boucle
+   asyncio pour un handler async, et les threads où la requête a exécuté
+   du SQL (handler sync, run_in_threadpool). Un handler sync qui n'a pas
+   encore fait de SQL peut appeler note_thread().
+
+Les piles des threads inactifs (boucle asyncio en attente, threads du pool
+qui attendent du travail) sont ignorées. Tout est propre à chaque worker :
+la réponse indique le pid qui a répondu.
+
+Section "profiling" de config/settings.json.
+"""
+import asyncio
+import contextvars
+import itertools
+import re
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import event
+
+from .config import get_section
+from .database import engine
+
+DEFAULTS = {
+    "sample_interval": 0.01,
+    "max_profile_seconds": 300,
+    "slow_request_seconds": 1.0,
+    "slow_requests_keep": 50,
+    "max_sql_per_request": 200,
+    "ignore_paths": [r"^/workspace/upload$", r"^/sync/files/\d+/delta$"],
+}
+
+# fichiers dans lesquels un thread est "en attente" (rien à profiler)
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    return get_section("profiling", DEFAULTS)
+
+
+# ---------------------------------------------------------
+# Piles
+# ---------------------------------------------------------
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).name}:{code.co_name}"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    if Path(code.co_filename).name in _IDLE_FILES:
+        return True
+    # thread d'un ThreadPoolExecutor qui attend une tâche (get() est en C)
+    return code.co_name == "_worker" and code.co_filename.endswith(os.path.join("futures", "thread.py"))
+
+
+def sample_stacks(skip_thread: int = None, only: set = None) -> dict:
+    """
+    Piles actives des threads (tous, ou ceux de `only`), de la racine à la
+    feuille : {ident du thread: pile}.
+    """
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = {}
+    for ident, frame in sys._current_frames().items():
+        if ident == skip_thread or (only is not None and ident not in only) or _is_idle(frame):
+            continue
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        labels.append(names.get(ident, f"thread-{ident}"))
+        labels.reverse()
+        stacks[ident] = ";".join(labels)
+    return stacks
+
+
+def to_folded(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+# ---------------------------------------------------------
+# Profileur à la demande
+# ---------------------------------------------------------
+
+class SamplingProfiler:
+    def __init__(self, interval: float, max_seconds: float):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.duration = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        """Démarre pour `seconds` secondes. False si déjà en cours."""
+        with self._lock:
+            if self.running:
+                return False
+            self.duration = min(float(seconds), self.max_seconds)
+            self._counts = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                stacks = sample_stacks(skip_thread=me)
+                with self._lock:
+                    self._counts.update(stacks.values())
+                    self.samples += 1
+                self._stop.wait(self.interval)
+        finally:
+            self.stopped_at = time.time()
+
+    def folded(self) -> str:
+        with self._lock:
+            return to_folded(self._counts)
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "running": self.running,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.samples,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_profiler() -> SamplingProfiler:
+    conf = get_settings()
+    return SamplingProfiler(float(conf["sample_interval"]), float(conf["max_profile_seconds"]))
+
+
+# ---------------------------------------------------------
+# Requêtes lentes
+# ---------------------------------------------------------
+
+# requête HTTP en cours (la contextvar suit aussi les appels run_in_threadpool)
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def note_thread():
+    """Rattache le thread courant à la requête en cours (échantillonnage)."""
+    request = _current_request.get()
+    if request is not None:
+        request.threads.add(threading.get_ident())
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = _current_request.get()
+    if request is not None:
+        request.threads.add(threading.get_ident())
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = _current_request.get()
+    if request is None:
+        return
+    starts = conn.info.get("query_start")
+    if starts:
+        request.add_query(statement, time.perf_counter() - starts.pop())
+
+
+class _InFlight:
+    __slots__ = ("id", "scope", "method", "path", "query", "started", "started_at", "max_sql",
+                 "sql", "sql_count", "sql_seconds", "loop_thread", "threads", "stacks",
+                 "samples", "done")
+
+    def __init__(self, request_id: int, scope: dict, max_sql: int):
+        self.id = request_id
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = scope.get("query_string", b"").decode("latin-1")
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.max_sql = max_sql
+        self.sql = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # begin() est appelé par le middleware, sur la boucle asyncio
+        self.loop_thread = threading.get_ident()
+        self.threads = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self.done = False
+
+    def add_query(self, statement: str, seconds: float):
+        # on ne garde que les `max_sql` premières, les totaux comptent tout
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        if len(self.sql) < self.max_sql:
+            self.sql.append((statement, seconds))
+
+    def handler_threads(self) -> set:
+        # "endpoint" est posé dans le scope par le routeur
+        threads = set(self.threads)
+        if asyncio.iscoroutinefunction(self.scope.get("endpoint")):
+            threads.add(self.loop_thread)
+        return threads
+
+
+class SlowRequestTracker:
+    def __init__(self, threshold: float, keep: int, interval: float, max_sql: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_sql = max_sql
+        self._ids = itertools.count(1)
+        self._inflight = {}
+        self._records = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -- surveillance ----------------------------------------------------
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="slow-request-watch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        me = threading.get_ident()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                slow = [r for r in self._inflight.values() if now - r.started >= self.threshold / 2]
+            if not slow:
+                self._stop.wait(self.threshold / 4)
+                continue
+            threads = {r.id: r.handler_threads() for r in slow}
+            stacks = sample_stacks(skip_thread=me, only=set().union(*threads.values()))
+            with self._lock:
+                for r in slow:
+                    r.stacks.update(stacks[t] for t in threads[r.id] if t in stacks)
+                    r.samples += 1
+            self._stop.wait(self.interval)
+
+    # -- cycle d'une requête ---------------------------------------------
+
+    def begin(self, scope: dict) -> _InFlight:
+        request = _InFlight(next(self._ids), scope, self.max_sql)
+        with self._lock:
+            self._inflight[request.id] = request
+        return request
+
+    def end(self, request: _InFlight, status: int):
+        if request.done:
+            return
+        request.done = True
+        duration = time.monotonic() - request.started
+        with self._lock:
+            self._inflight.pop(request.id, None)
+            if duration < self.threshold:
+                return
+            self._records.append({
+                "id": request.id,
+                "pid": os.getpid(),
+                "method": request.method,
+                "path": request.path,
+                "query": request.query,
+                "status": status,
+                "started_at": request.started_at,
+                "duration": round(duration, 4),
+                "sql_count": request.sql_count,
+                "sql_seconds": round(request.sql_seconds, 4),
+                "sql": [{"statement": s, "seconds": round(t, 6)} for s, t in request.sql],
+                "samples": request.samples,
+                "folded": to_folded(request.stacks),
+            })
+
+    def records(self) -> list:
+        with self._lock:
+            return list(self._records)
+
+    def get(self, request_id: int):
+        with self._lock:
+            for record in self._records:
+                if record["id"] == request_id:
+                    return record
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_slow_request_tracker() -> SlowRequestTracker:
+    conf = get_settings()
+    return SlowRequestTracker(
+        threshold=float(conf["slow_request_seconds"]),
+        keep=int(conf["slow_requests_keep"]),
+        interval=float(conf["sample_interval"]),
+        max_sql=int(conf["max_sql_per_request"]),
+    )
+
+
+class SlowRequestMiddleware:
+    """Middleware ASGI : chronomètre chaque requête HTTP et note son SQL."""
+
+    def __init__(self, app):
+        self.app = app
+        self.ignore_paths = [re.compile(p) for p in get_settings()["ignore_paths"]]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or any(p.match(scope["path"]) for p in self.ignore_paths):
+            await self.app(scope, receive, send)
+            return
+
+        tracker = get_slow_request_tracker()
+        request = tracker.begin(scope)
+        token = _current_request.set(request)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                tracker.end(request, message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            # pas de réponse (exception) : on enregistre quand même
+            tracker.end(request, 500)
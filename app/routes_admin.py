@@ -1,7 +1,18 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 
+from . import activity
+from .admission import get_admission
+from .auth import get_user_record
+from .cache import cache_stats
 from .database import get_db
+from .jobs import queue_stats
+from .profiling import get_profiler, get_slow_request_tracker
+from .transfers import get_scheduler
 
 router = APIRouter(
     prefix="/admin",
@@ -9,6 +20,16 @@ router = APIRouter(
 )
 
 
+def require_admin(username: str, db: Session = Depends(get_db)):
+    """
+    Dépendance : 'username' (query) doit être un compte admin.
+    """
+    user = get_user_record(db, username)
+    if not user or user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    return user
+
+
 @router.get("/health")
 def admin_health(db: Session = Depends(get_db)):
     """
@@ -16,3 +37,145 @@ def admin_health(db: Session = Depends(get_db)):
     """
     return {"status": "ok", "scope": "admin"}
 
+
+
+@router.get("/transfers")
+def transfers_stats(admin: dict = Depends(require_admin)):
+    """
+    Transferts en cours et débit alloué à chacun.
+    """
+    return get_scheduler().stats()
+
+
+@router.get("/cache")
+def cache_statistics(admin: dict = Depends(require_admin)):
+    """
+    Compteurs hit / miss / éviction des caches mémoire (voir cache.py).
+    """
+    return cache_stats()
+
+
+@router.get("/jobs")
+def jobs_statistics(admin: dict = Depends(require_admin)):
+    """
+    File de tâches de fond : profondeur par type et latences (voir jobs.py).
+    """
+    return queue_stats()
+
+
+@router.get("/storage")
+def storage_statistics(admin: dict = Depends(require_admin)):
+    """
+    Place disque, réservations des uploads en cours et latence d'écriture
+    du SSD (voir admission.py).
+    """
+    return get_admission().stats()
+
+
+@router.get("/activity")
+def activity_log(
+    user: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    before: Optional[float] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+    admin: dict = Depends(require_admin),
+):
+    """
+    Journal d'activité filtré par utilisateur, action et période (dates
+    ISO 8601), du plus récent au plus ancien. Page suivante : before = "ts"
+    et before_id = "id" du dernier événement reçu.
+    """
+    limit = max(1, min(limit, 1000))
+    until_ts = until.timestamp() if until else None
+    cursor = None
+    if before is not None and before_id is not None:
+        cursor = (before, before_id)
+    elif before is not None:
+        # "ts" seul (ancien curseur) : borne stricte
+        until_ts = before if until_ts is None else min(until_ts, before)
+    return {
+        "events": activity.query(
+            user=user,
+            action=action,
+            since=since.timestamp() if since else None,
+            until=until_ts,
+            before=cursor,
+            limit=limit,
+        ),
+        "buffer": activity.stats(),
+    }
+
+
+# ---------------------------------------------------------
+# Profilage (voir profiling.py) — propre au worker qui répond
+# ---------------------------------------------------------
+
+def _folded_response(text: str, name: str) -> PlainTextResponse:
+    return PlainTextResponse(text, headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+
+@router.post("/profile/start")
+def profile_start(seconds: float = 30, admin: dict = Depends(require_admin)):
+    """
+    Lance le profileur par échantillonnage pour `seconds` secondes.
+    """
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="Durée invalide")
+    profiler = get_profiler()
+    if not profiler.start(seconds):
+        raise HTTPException(status_code=409, detail="Profilage déjà en cours")
+    return profiler.status()
+
+
+@router.post("/profile/stop")
+def profile_stop(admin: dict = Depends(require_admin)):
+    profiler = get_profiler()
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profile")
+def profile_status(admin: dict = Depends(require_admin)):
+    return get_profiler().status()
+
+
+@router.get("/profile/folded")
+def profile_folded(admin: dict = Depends(require_admin)):
+    """
+    Piles échantillonnées au format "folded" (flamegraph.pl, speedscope).
+    """
+    profiler = get_profiler()
+    return _folded_response(profiler.folded(), f"profile-{profiler.started_at or 0:.0f}.folded")
+
+
+@router.get("/profile/slow")
+def slow_requests(admin: dict = Depends(require_admin)):
+    """
+    Dernières requêtes plus lentes que `slow_request_seconds` (résumé).
+    """
+    return [
+        {k: v for k, v in record.items() if k not in ("sql", "folded")}
+        for record in reversed(get_slow_request_tracker().records())
+    ]
+
+
+@router.get("/profile/slow/{request_id}")
+def slow_request_detail(request_id: int, admin: dict = Depends(require_admin)):
+    """
+    Détail d'une requête lente : requêtes SQL et piles échantillonnées.
+    """
+    record = get_slow_request_tracker().get(request_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Requête introuvable (buffer d'un autre worker ?)")
+    return record
+
+
+@router.get("/profile/slow/{request_id}/folded")
+def slow_request_folded(request_id: int, admin: dict = Depends(require_admin)):
+    record = get_slow_request_tracker().get(request_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Requête introuvable (buffer d'un autre worker ?)")
+    return _folded_response(record["folded"], f"slow-request-{request_id}.folded")
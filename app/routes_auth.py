@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from datetime import datetime
 
 from app.database import get_db
 from app.models import User
-from app.auth import hash_password, verify_password, create_access_token
+from app.auth import hash_password, verify_password, create_access_token, get_user_record
+from app.activity import record
+from app.cache import invalidate_user
 from app import schemas
 
 router = APIRouter(
@@ -16,19 +18,21 @@ router = APIRouter(
 # LOGIN
 # ---------------------------------------------------------
 @router.post("/login", response_model=schemas.Token)
-def login(credentials: schemas.LoginRequest, db: Session = Depends(get_db)):
+def login(credentials: schemas.LoginRequest, request: Request, db: Session = Depends(get_db)):
 
-    # Récupérer l'utilisateur
-    user = db.query(User).filter(User.username == credentials.username).first()
+    # Récupérer l'utilisateur (via le cache)
+    user = get_user_record(db, credentials.username)
 
     if not user:
+        record("login_failed", credentials.username, request=request, reason="unknown_user")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Identifiants invalides",
         )
 
     # Vérifier mot de passe
-    if not verify_password(credentials.password, user.password_hash):
+    if not verify_password(credentials.password, user["password_hash"]):
+        record("login_failed", credentials.username, request=request, reason="bad_password")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Identifiants invalides",
@@ -36,14 +40,15 @@ def login(credentials: schemas.LoginRequest, db: Session = Depends(get_db)):
 
     # Générer un vrai token JWT
     access_token = create_access_token(
-        {"sub": user.username, "role": user.role}
+        {"sub": user["username"], "role": user["role"]}
     )
+    record("login", user["username"], request=request)
 
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "role": user.role,
-        "username": user.username,
+        "role": user["role"],
+        "username": user["username"],
     }
 
 
@@ -51,7 +56,7 @@ def login(credentials: schemas.LoginRequest, db: Session = Depends(get_db)):
 # REGISTER
 # ---------------------------------------------------------
 @router.post("/register")
-def register_user(payload: dict, db: Session = Depends(get_db)):
+def register_user(payload: dict, request: Request, db: Session = Depends(get_db)):
     username = payload.get("username")
     password = payload.get("password")
 
@@ -59,7 +64,7 @@ def register_user(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Tous les champs sont obligatoires.")
 
     # Vérifier existence
-    if db.query(User).filter(User.username == username).first():
+    if get_user_record(db, username):
         raise HTTPException(status_code=400, detail="Nom d’utilisateur déjà utilisé.")
 
     # Créer nouvel utilisateur
@@ -73,6 +78,8 @@ def register_user(payload: dict, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    invalidate_user(username)
+    record("register", username, request=request)
 
     return {
         "status": "ok",
@@ -93,27 +100,27 @@ def me(username: str = None, db: Session = Depends(get_db)):
     """Return basic info about a user (for the frontend)."""
     if not username:
         raise HTTPException(status_code=400, detail="username required")
-    user = db.query(User).filter(User.username == username).first()
+    user = get_user_record(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
-    return {"username": user.username, "role": user.role}
+    return {"username": user["username"], "role": user["role"]}
 
 
 @router.get("/settings/{username}", response_model=SettingsOut)
 def get_settings(username: str, db: Session = Depends(get_db)):
     """Return user settings stored as JSON string."""
-    user = db.query(User).filter(User.username == username).first()
+    user = get_user_record(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
     try:
-        settings = json.loads(getattr(user, 'settings', None) or "{}")
+        settings = json.loads(user["settings"] or "{}")
     except Exception:
         settings = {}
-    return {"username": user.username, "settings": settings}
+    return {"username": user["username"], "settings": settings}
 
 
 @router.post("/settings/update")
-def update_settings(payload: SettingsUpdateRequest, db: Session = Depends(get_db)):
+def update_settings(payload: SettingsUpdateRequest, request: Request, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == payload.username).first()
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
@@ -126,26 +133,31 @@ def update_settings(payload: SettingsUpdateRequest, db: Session = Depends(get_db
     user.settings = json.dumps(existing)
     db.add(user)
     db.commit()
+    invalidate_user(user.username)
+    record("settings_update", user.username, request=request, keys=sorted(payload.settings or {}))
     return {"status": "ok", "settings": existing}
 
 
 @router.post("/change_password")
-def change_password(payload: ChangePasswordRequest, db: Session = Depends(get_db)):
+def change_password(payload: ChangePasswordRequest, request: Request, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == payload.username).first()
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
     # verify old password
     if not verify_password(payload.old_password, user.password_hash):
+        record("password_change_failed", user.username, request=request)
         raise HTTPException(status_code=401, detail="Mot de passe invalide")
     # set new
     user.password_hash = hash_password(payload.new_password)
     db.add(user)
     db.commit()
+    invalidate_user(user.username)
+    record("password_change", user.username, request=request)
     return {"status": "ok", "message": "Mot de passe modifié."}
 
 
 @router.post("/block_user")
-def block_user(payload: BlockUserRequest, db: Session = Depends(get_db)):
+def block_user(payload: BlockUserRequest, request: Request, db: Session = Depends(get_db)):
     """Block or unblock a target user by adding/removing them from settings.blocked (list)."""
     user = db.query(User).filter(User.username == payload.username).first()
     if not user:
@@ -163,4 +175,6 @@ def block_user(payload: BlockUserRequest, db: Session = Depends(get_db)):
     user.settings = json.dumps(s)
     db.add(user)
     db.commit()
+    invalidate_user(user.username)
+    record("user_block" if payload.action == "block" else "user_unblock", user.username, target=payload.target, request=request)
     return {"status": "ok", "blocked": s["blocked"]}
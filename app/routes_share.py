@@ -0,0 +1,154 @@
+import time
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from .activity import record
+from .auth import get_user_role
+from .cache import file_cache, invalidate_share_link, share_link_cache
+from .database import get_db
+from . import models, schemas
+from .sharing import (
+    InvalidToken,
+    download_counter,
+    get_settings,
+    load_file_entry,
+    load_link_state,
+    make_token,
+    parse_token,
+)
+from .transfers import ScheduledFileResponse
+
+router = APIRouter(
+    prefix="/share",
+    tags=["share"],
+)
+
+# Téléchargement public : URL courte, pas de compte
+public_router = APIRouter(tags=["share"])
+
+
+def _link_out(link: models.ShareLink) -> dict:
+    return {
+        "id": link.id,
+        "file_id": link.file_id,
+        "created_by": link.created_by,
+        "created_at": link.created_at,
+        "expires_at": link.expires_at,
+        "max_bytes_per_sec": link.max_bytes_per_sec,
+        "download_count": link.download_count,
+        "revoked": link.revoked,
+        "url": f"/s/{make_token(link.id, link.file_id, link.expires_at, link.max_bytes_per_sec or 0)}",
+    }
+
+
+@router.post("/links")
+def create_link(payload: schemas.ShareLinkCreate, request: Request, db: Session = Depends(get_db)):
+    """
+    Crée un lien public expirant vers un fichier (propriétaire ou admin).
+    """
+    db_file = (
+        db.query(models.File)
+        .filter(models.File.id == payload.file_id, models.File.is_deleted.isnot(True))
+        .first()
+    )
+    if not db_file:
+        raise HTTPException(status_code=404, detail="Fichier introuvable en base")
+    if db_file.owner != payload.username and get_user_role(db, payload.username) != "admin":
+        raise HTTPException(status_code=403, detail="Seul le propriétaire peut partager ce fichier")
+
+    conf = get_settings()
+    expires_in = payload.expires_in or int(conf["default_expires_in"])
+    if not 0 < expires_in <= int(conf["max_expires_in"]):
+        raise HTTPException(status_code=400, detail="Durée de validité invalide")
+    if payload.max_bytes_per_sec is not None and payload.max_bytes_per_sec <= 0:
+        raise HTTPException(status_code=400, detail="Plafond de débit invalide")
+
+    link = models.ShareLink(
+        file_id=db_file.id,
+        created_by=payload.username,
+        expires_at=int(time.time()) + expires_in,
+        max_bytes_per_sec=payload.max_bytes_per_sec,
+        download_count=0,
+        revoked=False,
+    )
+    db.add(link)
+    db.commit()
+    db.refresh(link)
+    record("share_create", payload.username, target=db_file.id, request=request,
+           link_id=link.id, expires_at=link.expires_at)
+    return _link_out(link)
+
+
+@router.get("/links")
+def list_links(username: str, file_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Liens créés par `username` (tous les liens pour un admin).
+    """
+    query = db.query(models.ShareLink)
+    if get_user_role(db, username) != "admin":
+        query = query.filter(models.ShareLink.created_by == username)
+    if file_id is not None:
+        query = query.filter(models.ShareLink.file_id == file_id)
+    pending = download_counter.pending()
+    links = []
+    for link in query.order_by(models.ShareLink.id.desc()).all():
+        out = _link_out(link)
+        out["download_count"] += pending.get(link.id, 0)
+        links.append(out)
+    return links
+
+
+@router.post("/links/{link_id}/revoke")
+def revoke_link(link_id: int, payload: schemas.ShareLinkRevoke, request: Request,
+                db: Session = Depends(get_db)):
+    link = db.query(models.ShareLink).filter(models.ShareLink.id == link_id).first()
+    if not link:
+        raise HTTPException(status_code=404, detail="Lien introuvable")
+    if link.created_by != payload.username and get_user_role(db, payload.username) != "admin":
+        raise HTTPException(status_code=403, detail="Seul le créateur peut révoquer ce lien")
+    link.revoked = True
+    db.commit()
+    invalidate_share_link(link_id)
+    record("share_revoke", payload.username, target=link.file_id, request=request, link_id=link_id)
+    return {"status": "ok", "id": link_id, "revoked": True}
+
+
+@public_router.get("/s/{token}")
+def shared_download(token: str, request: Request):
+    """
+    Téléchargement public. Chemin rapide : token vérifié par HMAC, état du
+    lien et chemin du fichier lus dans le cache mémoire, pas de session DB.
+    """
+    try:
+        claims = parse_token(token)
+    except InvalidToken as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+    link_id = claims["link_id"]
+    state = share_link_cache().get_or_load(link_id, lambda: load_link_state(link_id))
+    if not state or state["revoked"] or state["file_id"] != claims["file_id"]:
+        raise HTTPException(status_code=404, detail="Lien invalide")
+
+    file_id = claims["file_id"]
+    entry = file_cache().get_or_load(file_id, lambda: load_file_entry(file_id))
+    path = Path(entry["path"]) if entry else None
+    if not path or not path.exists():
+        raise HTTPException(status_code=404, detail="Fichier introuvable")
+
+    # un lecteur vidéo envoie plusieurs requêtes Range : on ne compte que le début
+    http_range = request.headers.get("range")
+    if not http_range or http_range.replace(" ", "").startswith("bytes=0-"):
+        download_counter.hit(link_id)
+        record("share_download", None, target=file_id, request=request, link_id=link_id)
+    client = request.client.host if request.client else "anonymous"
+    return ScheduledFileResponse(
+        path,
+        user=f"share:{client}",
+        max_rate=claims["max_bytes_per_sec"],
+        stat_result=path.stat(),
+        media_type="application/octet-stream",
+        filename=entry["filename"],
+    )
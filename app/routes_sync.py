@@ -0,0 +1,196 @@
+import base64
+import binascii
+import os
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from .activity import record
+from .admission import InsufficientStorage, get_admission
+from .auth import get_user_role
+from .cache import invalidate_listings
+from .chunkstore import enqueue_store_version, snapshot, snapshot_previous
+from .database import get_db
+from . import models, schemas
+from .sync import (
+    DEFAULT_BLOCK_SIZE,
+    MAX_BLOCK_SIZE,
+    MIN_BLOCK_SIZE,
+    DeltaError,
+    apply_delta,
+    file_signature,
+    mark_changed,
+)
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["sync"],
+)
+
+MAX_CHANGES_PAGE = 1000
+
+
+def _get_file(db: Session, file_id: int) -> models.File:
+    db_file = (
+        db.query(models.File)
+        .filter(models.File.id == file_id, models.File.is_deleted.isnot(True))
+        .first()
+    )
+    if not db_file:
+        raise HTTPException(status_code=404, detail="Fichier introuvable en base")
+    if not Path(db_file.path).exists():
+        raise HTTPException(status_code=404, detail="Fichier introuvable sur le disque")
+    return db_file
+
+
+@router.get("/changes")
+def changes(
+    cursor: int = 0,
+    limit: int = 500,
+    location_type: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Fichiers modifiés depuis `cursor` (0 = tout). Le client garde le
+    "cursor" retourné et le renvoie au prochain appel ; tant que "has_more"
+    est vrai, il reste des changements à lire.
+    """
+    limit = max(1, min(limit, MAX_CHANGES_PAGE))
+    query = db.query(models.File).filter(models.File.change_seq > cursor)
+    if location_type:
+        query = query.filter(models.File.location_type == location_type)
+    rows = query.order_by(models.File.change_seq).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "cursor": rows[-1].change_seq if rows else cursor,
+        "has_more": has_more,
+        "changes": [
+            {
+                "id": f.id,
+                "filename": f.filename,
+                "owner": f.owner,
+                "location_type": f.location_type,
+                "size": f.size,
+                "sha256": f.sha256,
+                "updated_at": f.updated_at,
+                "change_seq": f.change_seq,
+                "deleted": bool(f.is_deleted),
+            }
+            for f in rows
+        ],
+    }
+
+
+@router.get("/files/{file_id}/signature")
+def signature(file_id: int, block_size: int = DEFAULT_BLOCK_SIZE, db: Session = Depends(get_db)):
+    """
+    Signature par blocs (Adler-32 + MD5) de la version stockée.
+    "change_seq" est à renvoyer avec le delta (base_change_seq).
+    """
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise HTTPException(status_code=400, detail="block_size invalide")
+    db_file = _get_file(db, file_id)
+    path = Path(db_file.path)
+    return {
+        "file_id": db_file.id,
+        "size": path.stat().st_size,
+        "change_seq": db_file.change_seq,
+        "block_size": block_size,
+        "blocks": file_signature(path, block_size),
+    }
+
+
+@router.post("/files/{file_id}/delta")
+def upload_delta(file_id: int, payload: schemas.DeltaRequest, request: Request,
+                 db: Session = Depends(get_db)):
+    """
+    Construit la nouvelle version du fichier à partir de l'ancienne et du
+    delta (instructions copy / data). Réservé au propriétaire ou à un admin.
+    """
+    if not MIN_BLOCK_SIZE <= payload.block_size <= MAX_BLOCK_SIZE:
+        raise HTTPException(status_code=400, detail="block_size invalide")
+    db_file = _get_file(db, file_id)
+    if db_file.owner != payload.username and get_user_role(db, payload.username) != "admin":
+        raise HTTPException(status_code=403, detail="Seul le propriétaire peut modifier ce fichier")
+    if payload.base_change_seq != db_file.change_seq:
+        raise HTTPException(status_code=409, detail="Le fichier a changé depuis la signature")
+
+    instructions = []
+    for ins in payload.instructions:
+        if ins.op == "copy" and ins.index is not None and ins.count >= 1:
+            instructions.append({"op": "copy", "index": ins.index, "count": ins.count})
+        elif ins.op == "data" and ins.data is not None:
+            try:
+                instructions.append({"op": "data", "data": base64.b64decode(ins.data, validate=True)})
+            except binascii.Error:
+                raise HTTPException(status_code=400, detail="Données base64 invalides")
+        else:
+            raise HTTPException(status_code=400, detail=f"Instruction invalide : {ins.op}")
+
+    # la nouvelle version est écrite à côté de l'ancienne : on réserve sa
+    # taille maximale (le middleware n'a réservé que le corps JSON)
+    path = Path(db_file.path)
+    max_size = sum(
+        ins["count"] * payload.block_size if ins["op"] == "copy" else len(ins["data"])
+        for ins in instructions
+    )
+    # contenu actuel pas encore versionné : figé avant d'être remplacé
+    previous = snapshot_previous(db, db_file)
+    committed = False
+    try:
+        admission = get_admission()
+        with admission.reserve(max_size) as reservation:
+            tmp_path, size, sha256 = apply_delta(
+                path, instructions, payload.block_size, path.parent, expected_sha256=payload.sha256,
+                progress=lambda out, written, final=False: admission.checkpoint(
+                    out, reservation, written, final=final),
+            )
+            try:
+                snapshot_path = snapshot(tmp_path)
+                # Changement conditionnel : si un autre delta est passé depuis
+                # base_change_seq, l'UPDATE ne touche rien et on abandonne.
+                # Sinon le verrou d'écriture SQLite est tenu jusqu'au commit :
+                # le remplacement du fichier ne peut pas se croiser avec un autre.
+                db_file.size = size
+                db_file.sha256 = sha256
+                if not mark_changed(db, db_file, expected_seq=payload.base_change_seq):
+                    db.rollback()
+                    snapshot_path.unlink()
+                    raise HTTPException(status_code=409, detail="Le fichier a changé depuis la signature")
+                os.replace(tmp_path, path)
+                db.commit()
+                committed = True
+            finally:
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+    except InsufficientStorage as exc:
+        raise HTTPException(status_code=507, detail=exc.detail)
+    except DeltaError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        # delta refusé : le contenu actuel reste en place, rien à figer
+        if not committed and previous is not None:
+            previous[0].unlink(missing_ok=True)
+
+    db.refresh(db_file)
+    invalidate_listings()
+    if previous is not None:
+        enqueue_store_version(db_file, db_file.owner, previous[0], sha256=previous[1])
+    enqueue_store_version(db_file, payload.username, snapshot_path, sha256=sha256)
+    record("sync_delta", payload.username, target=db_file.id, request=request, size=size)
+
+    return {
+        "status": "ok",
+        "file": {
+            "id": db_file.id,
+            "size": size,
+            "sha256": sha256,
+            "change_seq": db_file.change_seq,
+        },
+    }
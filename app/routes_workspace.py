@@ -1,12 +1,30 @@
+import hashlib
+import os
+import tempfile
 from pathlib import Path
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
+from typing import Optional
+
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form, Request
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from .activity import record
+from .admission import get_admission
+from .auth import get_user_role
+from .cache import invalidate_listings, listing_cache
+from .chunkstore import (
+    enqueue_store_version,
+    iter_version_bytes,
+    restore_version,
+    snapshot,
+    snapshot_previous,
+)
 from .database import get_db
-from . import models
+from . import models, schemas
+from .sync import mark_changed
+from .transfers import ScheduledFileResponse, ScheduledStreamingResponse, get_scheduler
 
 router = APIRouter(
     prefix="/workspace",
@@ -15,7 +33,14 @@ router = APIRouter(
 
 # Dossier du workspace sur le disque
 WORKSPACE_DIR = Path(__file__).resolve().parent.parent / "data" / "workspace"
-WORKSPACE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def ensure_workspace_dir():
+    """
+    Crée le dossier du workspace s'il n'existe pas.
+    Appelé au démarrage (lifespan) et non à l'import du module.
+    """
+    WORKSPACE_DIR.mkdir(parents=True, exist_ok=True)
 
 
 @router.get("/health")
@@ -24,30 +49,116 @@ def health():
 
 
 @router.get("/files")
-def list_files(db: Session = Depends(get_db)):
+def list_files(offset: int = 0, limit: Optional[int] = None, db: Session = Depends(get_db)):
     """
     Liste les fichiers connus dans la base pour le workspace.
     (plus tard on rajoutera les rôles / filtres)
+    Les pages sont mises en cache (cache "listings") jusqu'au prochain upload.
     """
-    files = (
+    def load():
+        query = (
+            db.query(models.File)
+            .filter(models.File.location_type == "workspace")
+            .order_by(models.File.id)
+            .offset(offset)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return [
+            {
+                "id": f.id,
+                "filename": f.filename,
+                "owner": f.owner,
+                "path": f.path,
+                "created_at": f.created_at,
+            }
+            for f in query.all()
+        ]
+
+    return listing_cache().get_or_load(("workspace", offset, limit), load)
+
+
+def _find_workspace_file(db: Session, filename: str):
+    return (
         db.query(models.File)
-        .filter(models.File.location_type == "workspace")
-        .all()
+        .filter(
+            models.File.location_type == "workspace",
+            models.File.filename == filename,
+            models.File.is_deleted.isnot(True),
+        )
+        .order_by(models.File.id.desc())
+        .first()
     )
-    return [
-        {
-            "id": f.id,
-            "filename": f.filename,
-            "owner": f.owner,
-            "path": f.path,
-            "created_at": f.created_at,
-        }
-        for f in files
-    ]
+
+
+def _write_upload(src, dest_path: Path, reservation: Optional[str]):
+    """
+    Copie le corps reçu (fichier temporaire de Starlette) vers dest_path.
+    La place a été réservée par le middleware d'admission : checkpoint()
+    pousse les écritures sur le SSD par paquets (fsync chronométré, pour
+    détecter un SSD saturé) et ramène la réservation à ce qui reste.
+    Retourne (lien figé du nouveau contenu, taille, sha256).
+    """
+    chunk_size = get_scheduler().chunk_size
+    admission = get_admission()
+    digest = hashlib.sha256()
+    written = 0
+    src.seek(0)
+    fd, tmp_name = tempfile.mkstemp(prefix=".upload-", dir=WORKSPACE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := src.read(chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+                if reservation:
+                    admission.checkpoint(f, reservation, written)
+            if reservation:
+                admission.checkpoint(f, reservation, written, final=True)
+        # lien pris avant le remplacement : un autre upload ne peut pas
+        # changer ce contenu avant que la tâche ne le versionne
+        snapshot_path = snapshot(Path(tmp_name))
+        os.replace(tmp_name, dest_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return snapshot_path, written, digest.hexdigest()
+
+
+def _save_upload(db: Session, db_file, filename: str, username: str, dest_path: Path,
+                 size: int, sha256: str, previous, snapshot_path: Path):
+    """
+    Partie SQLite de upload_file (appelée via run_in_threadpool). Met en
+    file les versions du contenu écrasé (`previous`, s'il n'en avait pas)
+    puis du nouveau contenu.
+    """
+    if db_file is None:
+        db_file = models.File(
+            filename=filename,
+            owner=username,
+            path=str(dest_path),
+            location_type="workspace",
+            created_at=datetime.utcnow(),
+        )
+        db.add(db_file)
+    db_file.size = size
+    db_file.sha256 = sha256
+    mark_changed(db, db_file)
+    db.commit()
+    db.refresh(db_file)
+    invalidate_listings()
+    if previous is not None:
+        enqueue_store_version(db_file, db_file.owner, previous[0], sha256=previous[1])
+    enqueue_store_version(db_file, username, snapshot_path, sha256=sha256)
+    return db_file
 
 
 @router.post("/upload")
 async def upload_file(
+    request: Request,
     username: str = Form(...),
     uploaded_file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -55,6 +166,8 @@ async def upload_file(
     """
     Upload d'un fichier dans le workspace.
     Pour l'instant, on passe 'username' à la main (on branchera avec le login plus tard).
+    Un fichier du même nom devient une nouvelle version (voir chunkstore.py) ;
+    le découpage en chunks est fait en tâche de fond, après la réponse.
     """
 
     if not uploaded_file.filename:
@@ -63,22 +176,37 @@ async def upload_file(
     # On construit un chemin simple : workspace/nom_du_fichier
     dest_path = WORKSPACE_DIR / uploaded_file.filename
 
-    # Écriture du fichier sur le disque
-    with dest_path.open("wb") as f:
-        content = await uploaded_file.read()
-        f.write(content)
+    # Handler async : tout accès SQLite passe par run_in_threadpool pour ne
+    # pas bloquer la boucle asyncio (et les autres transferts) sur le SSD.
+    db_file = await run_in_threadpool(_find_workspace_file, db, uploaded_file.filename)
+    # Contenu actuel pas encore versionné (fichier d'avant l'historique, ou
+    # tâche "store_version" pas encore passée) : on le fige avant de
+    # l'écraser, sa version sera créée en tâche de fond.
+    previous = None
+    if db_file is not None:
+        previous = await run_in_threadpool(snapshot_previous, db, db_file)
+
+    # Écriture dans un fichier temporaire puis remplacement atomique, dans
+    # un thread : un fsync sur un SSD saturé bloquerait tous les autres
+    # requêtes du worker. Le corps a déjà été reçu au débit du scheduler
+    # (PacedUploadMiddleware) : cette copie locale n'est pas cadencée.
+    try:
+        snapshot_path, written, sha256 = await run_in_threadpool(
+            _write_upload, uploaded_file.file, dest_path,
+            getattr(request.state, "write_reservation", None),
+        )
+    except BaseException:
+        if previous is not None:
+            previous[0].unlink(missing_ok=True)
+        raise
 
     # Enregistrement en base
-    db_file = models.File(
-        filename=uploaded_file.filename,
-        owner=username,
-        path=str(dest_path),
-        location_type="workspace",
-        created_at=datetime.utcnow(),
+    db_file = await run_in_threadpool(
+        _save_upload, db, db_file, uploaded_file.filename, username, dest_path,
+        written, sha256, previous, snapshot_path,
     )
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    record("upload", username, target=db_file.id, request=request,
+           filename=db_file.filename, size=written)
 
     return {
         "message": "Fichier uploadé dans le workspace",
@@ -92,9 +220,16 @@ async def upload_file(
 
 
 @router.get("/download/{file_id}")
-def download_file(file_id: int, db: Session = Depends(get_db)):
+def download_file(
+    file_id: int,
+    request: Request,
+    username: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
     """
     Télécharge / ouvre un fichier du workspace à partir de son id.
+    Le débit est partagé entre les téléchargements en cours (voir transfers.py) :
+    'username' (optionnel) sert au plafond par utilisateur, sinon l'IP du client.
     """
     db_file = (
         db.query(models.File)
@@ -112,8 +247,142 @@ def download_file(file_id: int, db: Session = Depends(get_db)):
     if not path.exists():
         raise HTTPException(status_code=404, detail="Fichier introuvable sur le disque")
 
-    return FileResponse(
+    record("download", username, target=db_file.id, request=request, filename=db_file.filename)
+    scheduler = get_scheduler()
+    return ScheduledFileResponse(
         path,
+        user=username or (request.client.host if request.client else "anonymous"),
+        weight=scheduler.weight_for_role(get_user_role(db, username)),
+        stat_result=path.stat(),
         media_type="application/octet-stream",
         filename=db_file.filename,
     )
+
+
+# ---------------------------------------------------------
+# Historique des versions
+# ---------------------------------------------------------
+
+def _get_workspace_file(db: Session, file_id: int) -> models.File:
+    db_file = (
+        db.query(models.File)
+        .filter(
+            models.File.id == file_id,
+            models.File.location_type == "workspace",
+        )
+        .first()
+    )
+    if not db_file:
+        raise HTTPException(status_code=404, detail="Fichier introuvable en base")
+    return db_file
+
+
+def _get_version(db: Session, file_id: int, version_no: int) -> models.FileVersion:
+    version = (
+        db.query(models.FileVersion)
+        .filter(
+            models.FileVersion.file_id == file_id,
+            models.FileVersion.version_no == version_no,
+        )
+        .first()
+    )
+    if not version:
+        raise HTTPException(status_code=404, detail="Version introuvable")
+    return version
+
+
+@router.get("/files/{file_id}/versions")
+def list_versions(file_id: int, db: Session = Depends(get_db)):
+    """
+    Versions conservées d'un fichier, de la plus récente à la plus ancienne.
+    """
+    _get_workspace_file(db, file_id)
+    versions = (
+        db.query(models.FileVersion)
+        .filter(models.FileVersion.file_id == file_id)
+        .order_by(models.FileVersion.version_no.desc())
+        .all()
+    )
+    return [
+        {
+            "version": v.version_no,
+            "size": v.size,
+            "sha256": v.sha256,
+            "created_by": v.created_by,
+            "created_at": v.created_at,
+        }
+        for v in versions
+    ]
+
+
+@router.get("/files/{file_id}/versions/{version_no}/download")
+def download_version(
+    file_id: int,
+    version_no: int,
+    request: Request,
+    username: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Télécharge une ancienne version, reconstituée à la volée depuis ses chunks.
+    """
+    db_file = _get_workspace_file(db, file_id)
+    version = _get_version(db, file_id, version_no)
+    stem, dot, ext = db_file.filename.rpartition(".")
+    name = f"{stem}.v{version_no}.{ext}" if dot else f"{db_file.filename}.v{version_no}"
+    record("version_download", username, target=file_id, request=request, version=version_no)
+    scheduler = get_scheduler()
+    return ScheduledStreamingResponse(
+        iter_version_bytes(db, version),
+        size=version.size,
+        user=username or (request.client.host if request.client else "anonymous"),
+        weight=scheduler.weight_for_role(get_user_role(db, username)),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Length": str(version.size),
+            "Content-Disposition": f'attachment; filename="{name}"',
+        },
+    )
+
+
+@router.post("/files/{file_id}/versions/{version_no}/restore")
+def restore_file_version(
+    file_id: int,
+    version_no: int,
+    payload: schemas.RestoreVersionRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    """
+    Remet une ancienne version comme version courante (elle devient la
+    version la plus récente). Réservé au propriétaire ou à un admin.
+    """
+    db_file = _get_workspace_file(db, file_id)
+    if db_file.owner != payload.username and get_user_role(db, payload.username) != "admin":
+        raise HTTPException(status_code=403, detail="Seul le propriétaire peut restaurer ce fichier")
+    version = _get_version(db, file_id, version_no)
+
+    # le contenu écrasé puis le contenu restauré deviennent les deux
+    # prochaines versions, dans cet ordre (tâches "store_version")
+    previous = snapshot_previous(db, db_file)
+    try:
+        restored = restore_version(db, db_file, version)
+    except BaseException:
+        if previous is not None:
+            previous[0].unlink(missing_ok=True)
+        raise
+    mark_changed(db, db_file)
+    db.commit()
+    invalidate_listings()
+    if previous is not None:
+        enqueue_store_version(db_file, db_file.owner, previous[0], sha256=previous[1])
+    enqueue_store_version(db_file, payload.username, restored,
+                          sha256=version.sha256, from_version=version.id)
+    record("version_restore", payload.username, target=file_id, request=request,
+           restored=version_no)
+
+    return {
+        "status": "ok",
+        "restored": version_no,
+        "sha256": version.sha256,
+    }
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 # =======================
@@ -81,3 +81,45 @@ class SettingsOut(BaseModel):
     username: str
     settings: dict
 
+
+
+# ====================
+#   SCHÉMAS SYNC
+# ====================
+
+class DeltaInstruction(BaseModel):
+    op: str  # "copy" ou "data"
+    index: Optional[int] = None   # copy : premier bloc de l'ancienne version
+    count: int = 1                # copy : nombre de blocs consécutifs
+    data: Optional[str] = None    # data : octets encodés en base64
+
+
+class DeltaRequest(BaseModel):
+    username: str
+    block_size: int
+    base_change_seq: int                   # change_seq reçu avec la signature
+    sha256: Optional[str] = None           # empreinte attendue du résultat
+    instructions: List[DeltaInstruction]
+
+
+# ====================
+#   SCHÉMAS VERSIONS
+# ====================
+
+class RestoreVersionRequest(BaseModel):
+    username: str
+
+
+# ====================
+#   SCHÉMAS PARTAGE
+# ====================
+
+class ShareLinkCreate(BaseModel):
+    username: str
+    file_id: int
+    expires_in: Optional[int] = None          # secondes
+    max_bytes_per_sec: Optional[int] = None   # plafond de débit du lien
+
+
+class ShareLinkRevoke(BaseModel):
+    username: str
@@ -0,0 +1,289 @@
+"""
+État partagé entre les workers (uvicorn --workers N / gunicorn).
+
+Chaque worker est un processus séparé : tout ce qui est en mémoire
+(caches, transferts en cours) doit être synchronisé via SQLite.
+
+- cache_invalidations : journal des invalidations de cache. Un worker qui
+  invalide une entrée l'écrit ici ; les autres relisent le journal au plus
+  toutes les `poll_interval` secondes et suppriment les mêmes entrées.
+  Les lignes plus vieilles que `invalidation_ttl` sont purgées au
+  démarrage puis par la purge horaire du JobRunner (jobs.py).
+- active_transfers : gros transferts en cours dans chaque worker, pour que
+  le partage de bande passante (transfers.py) tienne compte de tous les
+  processus. Relue au plus toutes les `poll_interval` secondes, dans un
+  thread (refresh()) : jamais de SQLite sur la boucle asyncio.
+- write_reservations : place disque réservée par les écritures en cours
+  (admission.py), pour que deux workers n'acceptent pas chacun un upload
+  qui ne tient qu'une fois.
+
+Les lignes d'un worker portent son jeton d'instance (instance_token() :
+boot_id du noyau, pid, date de démarrage du processus). Un pid seul ne
+suffit pas : le Pi redémarre souvent (coupures de courant) et l'ancien pid
+peut appartenir à un autre processus bien vivant. instance_alive() dit si
+le worker qui a écrit une ligne tourne encore.
+
+Section "shared_state" de config/settings.json.
+"""
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import Column, Float, Integer, String, Table, Boolean, delete, func, insert, select
+
+from .config import get_section
+from .database import Base, engine
+
+DEFAULTS = {
+    "poll_interval": 0.5,
+    # au-delà, une invalidation est forcément déjà vue par tous les workers
+    "invalidation_ttl": 3600,
+}
+
+cache_invalidations = Table(
+    "cache_invalidations",
+    Base.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("cache", String, nullable=False),
+    Column("key", String, nullable=True),  # NULL = vider tout le cache
+    Column("created_at", Float, nullable=False, index=True),
+    # AUTOINCREMENT : un id n'est jamais réutilisé, même quand la purge
+    # vide la table (sinon les workers, calés sur l'ancien max, rateraient
+    # les invalidations suivantes)
+    sqlite_autoincrement=True,
+)
+
+active_transfers = Table(
+    "active_transfers",
+    Base.metadata,
+    Column("id", String, primary_key=True),  # "<pid>:<id local>"
+    Column("pid", Integer, nullable=False, index=True),
+    Column("owner", String, nullable=True),  # instance_token()
+    Column("user", String, nullable=False),
+    Column("weight", Float, nullable=False),
+    Column("paced", Boolean, nullable=False),
+    Column("started_at", Float, nullable=False),
+)
+
+write_reservations = Table(
+    "write_reservations",
+    Base.metadata,
+    Column("id", String, primary_key=True),  # "<pid>:<id local>"
+    Column("pid", Integer, nullable=False, index=True),
+    Column("owner", String, nullable=True),  # instance_token()
+    Column("bytes", Integer, nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@lru_cache(maxsize=None)
+def _boot_id() -> str:
+    try:
+        return Path("/proc/sys/kernel/random/boot_id").read_text().strip()
+    except OSError:
+        return ""
+
+
+def _start_time(pid: int) -> str:
+    """Date de démarrage du processus (en ticks depuis le boot), "" si inconnue."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return ""
+    # le nom du programme (2e champ) peut contenir espaces et parenthèses
+    return stat.rpartition(")")[2].split()[19]
+
+
+def instance_token(pid: int = None) -> str:
+    """Identifie un processus de façon unique, même après un redémarrage du Pi."""
+    pid = pid or os.getpid()
+    return f"{_boot_id()}:{pid}:{_start_time(pid)}"
+
+
+def instance_alive(token) -> bool:
+    """Le processus de `token` tourne-t-il encore ? (None = ligne d'avant les jetons : non)"""
+    if not token:
+        return False
+    boot_id, _, rest = token.partition(":")
+    pid, _, start_time = rest.partition(":")
+    if boot_id != _boot_id() or not pid.isdigit() or not pid_alive(int(pid)):
+        return False
+    return _start_time(int(pid)) == start_time
+
+
+class InvalidationBus:
+    def __init__(self, poll_interval: float, ttl: float):
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self._last_id = None
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def publish(self, cache: str, key=None):
+        # on la relira aussi au prochain poll : sans effet, déjà appliquée ici
+        with engine.begin() as conn:
+            conn.execute(
+                insert(cache_invalidations).values(
+                    cache=cache, key=None if key is None else str(key), created_at=time.time()
+                )
+            )
+
+    def poll(self, apply):
+        """
+        Applique `apply(cache, key)` pour chaque invalidation publiée par un
+        autre processus depuis le dernier appel (au plus une lecture SQLite
+        toutes les `poll_interval` secondes).
+        """
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_poll = now
+            with engine.connect() as conn:
+                last = conn.execute(select(func.max(cache_invalidations.c.id))).scalar() or 0
+                if self._last_id is None:
+                    # premier passage : le cache est vide, on se place à la fin
+                    self._last_id = last
+                    return
+                if self._last_id > last:
+                    # ids repartis de 1 (table recréée) : on relit tout,
+                    # réappliquer une invalidation est sans danger
+                    self._last_id = 0
+                rows = conn.execute(
+                    select(cache_invalidations.c.id, cache_invalidations.c.cache, cache_invalidations.c.key)
+                    .where(cache_invalidations.c.id > self._last_id)
+                    .order_by(cache_invalidations.c.id)
+                ).all()
+            for row in rows:
+                apply(row.cache, row.key)
+                self._last_id = row.id
+        finally:
+            self._lock.release()
+
+    def prune(self):
+        with engine.begin() as conn:
+            conn.execute(delete(cache_invalidations)
+                         .where(cache_invalidations.c.created_at < time.time() - self.ttl))
+
+
+class TransferRegistry:
+    """Vue des gros transferts en cours dans les autres workers."""
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self._remote = []
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, transfer):
+        with engine.begin() as conn:
+            conn.execute(insert(active_transfers).values(
+                id=f"{self.pid}:{transfer.id}", pid=self.pid, owner=instance_token(),
+                user=transfer.user,
+                weight=transfer.weight, paced=transfer.paced, started_at=time.time(),
+            ))
+
+    def unregister(self, transfer):
+        with engine.begin() as conn:
+            conn.execute(delete(active_transfers)
+                         .where(active_transfers.c.id == f"{self.pid}:{transfer.id}"))
+
+    def stale(self) -> bool:
+        return time.monotonic() - self._last_poll >= self.poll_interval
+
+    def refresh(self):
+        """Relit les transferts des autres processus (SQLite : hors boucle asyncio)."""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_poll = time.monotonic()
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    select(active_transfers.c.pid, active_transfers.c.user, active_transfers.c.weight)
+                    .where(active_transfers.c.paced.is_(True), active_transfers.c.pid != self.pid)
+                ).all()
+            self._remote = [(r.user, r.weight) for r in rows]
+        finally:
+            self._lock.release()
+
+    def remote(self) -> list:
+        """[(user, weight)] des transferts cadencés des autres processus (dernier refresh())."""
+        return self._remote
+
+    def reap(self):
+        """Supprime les transferts des workers morts (crash, redémarrage)."""
+        with engine.begin() as conn:
+            owners = conn.execute(select(active_transfers.c.owner).distinct()).scalars().all()
+            dead = [owner for owner in owners if not instance_alive(owner)]
+            if dead:
+                conn.execute(delete(active_transfers).where(
+                    active_transfers.c.owner.in_(dead) | active_transfers.c.owner.is_(None)
+                ))
+
+
+@lru_cache(maxsize=None)
+def get_invalidation_bus() -> InvalidationBus:
+    conf = get_section("shared_state", DEFAULTS)
+    return InvalidationBus(float(conf["poll_interval"]), float(conf["invalidation_ttl"]))
+
+
+@lru_cache(maxsize=None)
+def get_transfer_registry() -> TransferRegistry:
+    conf = get_section("shared_state", DEFAULTS)
+    return TransferRegistry(float(conf["poll_interval"]))
+
+
+def reap_reservations():
+    """Libère la place réservée par des workers morts (crash, coupure de courant)."""
+    with engine.begin() as conn:
+        owners = conn.execute(select(write_reservations.c.owner).distinct()).scalars().all()
+        dead = [owner for owner in owners if not instance_alive(owner)]
+        if dead:
+            conn.execute(delete(write_reservations).where(
+                write_reservations.c.owner.in_(dead) | write_reservations.c.owner.is_(None)
+            ))
+
+
+def migrate(bind=engine):
+    """
+    Bases créées avant sqlite_autoincrement : cache_invalidations est
+    recréée avec AUTOINCREMENT (les ids existants sont gardés, la séquence
+    repart après le plus grand). Appelé par init_db, sous son verrou.
+    """
+    with bind.begin() as conn:
+        ddl = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cache_invalidations'"
+        ).scalar()
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+        conn.exec_driver_sql("ALTER TABLE cache_invalidations RENAME TO cache_invalidations_old")
+        for index in cache_invalidations.indexes:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+        cache_invalidations.create(conn)
+        conn.exec_driver_sql(
+            "INSERT INTO cache_invalidations (id, cache, key, created_at) "
+            "SELECT id, cache, key, created_at FROM cache_invalidations_old"
+        )
+        conn.exec_driver_sql("DROP TABLE cache_invalidations_old")
+
+
+def startup_cleanup():
+    """Appelé au démarrage de chaque worker (lifespan)."""
+    get_invalidation_bus().prune()
+    get_transfer_registry().reap()
+    reap_reservations()
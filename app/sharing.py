@@ -0,0 +1,189 @@
+"""
+Liens de partage publics (invités sans compte sur le réseau local).
+
+Token : "<link_id>.<file_id>.<expires_at>.<max_bps>.<signature>", la
+signature étant un HMAC-SHA256 des 4 premiers champs avec la clé du
+serveur. La vérification (signature + expiration) se fait sans base de
+données ; seuls le chemin du fichier et l'état "révoqué" du lien sont lus,
+une fois, puis servis par le cache mémoire.
+
+Les compteurs de téléchargements sont accumulés en mémoire et écrits dans
+SQLite par lots (flush_loop, toutes les `flush_interval` secondes).
+
+Clé : variable d'environnement HCD_SECRET_KEY, sinon data/secret.key
+(créée au premier usage).
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .config import get_section
+from .database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+SECRET_FILE = DATA_DIR / "secret.key"
+
+DEFAULTS = {
+    "default_expires_in": 24 * 3600,
+    "max_expires_in": 30 * 24 * 3600,
+    "flush_interval": 5,
+}
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> dict:
+    return get_section("sharing", DEFAULTS)
+
+
+@lru_cache(maxsize=None)
+def get_secret_key() -> bytes:
+    env = os.environ.get("HCD_SECRET_KEY")
+    if env:
+        return env.encode("utf-8")
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        # O_EXCL : si plusieurs workers démarrent ensemble, un seul crée la clé
+        fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            key = SECRET_FILE.read_bytes()
+            if key:
+                return key
+            time.sleep(0.01)
+        raise RuntimeError(f"{SECRET_FILE} est vide")
+    with os.fdopen(fd, "wb") as f:
+        key = secrets.token_hex(32).encode("ascii")
+        f.write(key)
+    return key
+
+
+def _sign(message: str) -> str:
+    mac = hmac.new(get_secret_key(), message.encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac).rstrip(b"=").decode("ascii")
+
+
+def make_token(link_id: int, file_id: int, expires_at: int, max_bps: int = 0) -> str:
+    message = f"{link_id}.{file_id}.{expires_at}.{max_bps or 0}"
+    return f"{message}.{_sign(message)}"
+
+
+def parse_token(token: str, now: float = None) -> dict:
+    """Vérifie signature et expiration, sans accès à la base."""
+    # isdigit() accepte des chiffres non ASCII ("١٢") : tout token non ASCII
+    # est refusé avant de signer ou de comparer
+    if not token.isascii():
+        raise InvalidToken("Lien invalide")
+    message, _, signature = token.rpartition(".")
+    parts = message.split(".")
+    if len(parts) != 4 or not all(p.isdigit() for p in parts):
+        raise InvalidToken("Lien invalide")
+    if not hmac.compare_digest(signature.encode("ascii"), _sign(message).encode("ascii")):
+        raise InvalidToken("Lien invalide")
+    link_id, file_id, expires_at, max_bps = (int(p) for p in parts)
+    if (now or time.time()) >= expires_at:
+        raise InvalidToken("Lien expiré")
+    return {
+        "link_id": link_id,
+        "file_id": file_id,
+        "expires_at": expires_at,
+        "max_bytes_per_sec": max_bps or None,
+    }
+
+
+# ---------------------------------------------------------
+# Compteurs de téléchargements (écriture par lots)
+# ---------------------------------------------------------
+
+class DownloadCounter:
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, link_id: int):
+        with self._lock:
+            self._counts[link_id] += 1
+
+    def flush(self) -> int:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return 0
+        try:
+            with engine.begin() as conn:
+                for link_id, n in counts.items():
+                    conn.execute(
+                        update(models.ShareLink)
+                        .where(models.ShareLink.id == link_id)
+                        .values(download_count=models.ShareLink.download_count + n)
+                    )
+        except Exception:
+            # on remet les compteurs pour le prochain essai
+            with self._lock:
+                self._counts.update(counts)
+            raise
+        return len(counts)
+
+    def pending(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+download_counter = DownloadCounter()
+
+
+async def flush_loop():
+    """Tâche de fond lancée par le lifespan."""
+    interval = float(get_settings()["flush_interval"])
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(download_counter.flush)
+            except Exception:
+                logger.exception("Écriture des compteurs de partage échouée")
+    finally:
+        # arrêt du serveur : on n'oublie pas les derniers téléchargements
+        await run_in_threadpool(download_counter.flush)
+
+
+def load_link_state(link_id: int):
+    """État du lien pour le cache "share_links" (None si inexistant)."""
+    db = SessionLocal()
+    try:
+        link = db.query(models.ShareLink).filter(models.ShareLink.id == link_id).first()
+        if not link:
+            return None
+        return {"revoked": bool(link.revoked), "file_id": link.file_id}
+    finally:
+        db.close()
+
+
+def load_file_entry(file_id: int):
+    """Chemin / nom du fichier pour le cache "files" (None si absent)."""
+    db = SessionLocal()
+    try:
+        f = db.query(models.File).filter(models.File.id == file_id).first()
+        if not f or f.is_deleted:
+            return None
+        return {"path": f.path, "filename": f.filename}
+    finally:
+        db.close()
@@ -0,0 +1,174 @@
+"""
+Livraison du frontend statique (index.html, app.js, styles.css).
+
+- build_static_assets() : étape de build (scripts/build_static.py).
+  Copie chaque asset sous static/dist/ avec un nom empreinte
+  (app.<hash>.js), génère les variantes .gz (et .br si le module "brotli"
+  est installé) et réécrit les URLs dans dist/index.html.
+- PrecompressedStaticFiles : sert /static en choisissant la variante
+  précompressée acceptée par le navigateur, avec Cache-Control immutable
+  pour les fichiers empreintés (ETag / 304 gérés par Starlette).
+- IndexPage : index.html gardé en mémoire (lu une seule fois), avec ETag.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+try:  # dépendance optionnelle
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+DIST_DIRNAME = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# Assets référencés par index.html
+ASSETS = ["app.js", "styles.css"]
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{10}\.[a-z0-9]+$")
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _write_variants(path: Path, data: bytes):
+    """Écrit le fichier + ses variantes précompressées."""
+    path.write_bytes(data)
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+
+def build_static_assets(static_dir: Path = STATIC_DIR) -> dict:
+    """
+    Construit static/dist/ et retourne le manifest
+    {"app.js": "dist/app.<hash>.js", ...}.
+    """
+    dist_dir = static_dir / DIST_DIRNAME
+    if dist_dir.exists():
+        shutil.rmtree(dist_dir)
+    dist_dir.mkdir(parents=True)
+
+    manifest = {}
+    for name in ASSETS:
+        data = (static_dir / name).read_bytes()
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{_fingerprint(data)}{ext}"
+        _write_variants(dist_dir / hashed, data)
+        manifest[name] = f"{DIST_DIRNAME}/{hashed}"
+
+    html = (static_dir / "index.html").read_text(encoding="utf-8")
+    for name, hashed in manifest.items():
+        html = html.replace(f'"/static/{name}"', f'"/static/{hashed}"')
+    _write_variants(dist_dir / "index.html", html.encode("utf-8"))
+
+    (dist_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def _accepted_encodings(headers: Headers) -> set:
+    accept = headers.get("accept-encoding", "")
+    encodings = set()
+    for part in accept.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        if token:
+            encodings.add(token.strip().lower())
+    return encodings
+
+
+def _pick_variant(full_path: str, headers: Headers):
+    """Retourne (chemin, content-encoding) de la meilleure variante disponible."""
+    accepted = _accepted_encodings(headers)
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in accepted and os.path.isfile(full_path + suffix):
+            return full_path + suffix, encoding
+    return full_path, None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles qui sert les variantes .br / .gz et pose Cache-Control."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+
+        headers = {
+            "Cache-Control": IMMUTABLE if FINGERPRINT_RE.search(full_path) else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        variant, encoding = _pick_variant(full_path, request_headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            stat_result = os.stat(variant)
+
+        # media_type explicite : sinon FileResponse le devinerait depuis ".gz"
+        response = FileResponse(
+            variant,
+            status_code=status_code,
+            stat_result=stat_result,
+            media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+            headers=headers,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class IndexPage:
+    """
+    index.html en mémoire : lu une seule fois (dist/ si le build existe),
+    avec ses variantes compressées et un ETag par variante.
+    """
+
+    def __init__(self, static_dir: Path = STATIC_DIR):
+        self.static_dir = static_dir
+        self._variants = None
+
+    def load(self):
+        dist_index = self.static_dir / DIST_DIRNAME / "index.html"
+        source = dist_index if dist_index.exists() else self.static_dir / "index.html"
+        data = source.read_bytes()
+        etag = hashlib.sha256(data).hexdigest()[:16]
+
+        bodies = {None: data, "gzip": gzip.compress(data, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(data)
+        self._variants = {
+            encoding: (body, f'"{etag}-{encoding}"' if encoding else f'"{etag}"')
+            for encoding, body in bodies.items()
+        }
+
+    def response(self, request: Request) -> Response:
+        if self._variants is None:
+            self.load()
+
+        accepted = _accepted_encodings(request.headers)
+        encoding = next((e for e in ("br", "gzip") if e in accepted and e in self._variants), None)
+        body, etag = self._variants[encoding]
+
+        headers = {"Cache-Control": REVALIDATE, "Vary": "Accept-Encoding", "ETag": etag}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="text/html", headers=headers)
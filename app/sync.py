@@ -0,0 +1,235 @@
+"""
+Synchronisation différentielle (type rsync) des fichiers stockés.
+
+1. Le client demande la signature du fichier serveur : pour chaque bloc de
+   `block_size` octets, une somme faible (Adler-32, calculable en glissant
+   octet par octet) et une somme forte (MD5).
+2. Le client parcourt sa nouvelle version avec une fenêtre glissante et
+   envoie un delta : des instructions "copy" (blocs déjà présents côté
+   serveur) et "data" (octets nouveaux).
+3. Le serveur reconstruit la nouvelle version à partir de l'ancienne.
+
+compute_delta() est l'implémentation de référence côté client
+(utilisée par scripts/sync_push.py).
+
+Le flux des changements repose sur File.change_seq : chaque modification
+d'un fichier lui donne un numéro plus grand que tous les précédents.
+"""
+import hashlib
+import os
+import tempfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
+_ADLER_MOD = 65521
+_READ_SIZE = 1024 * 1024
+
+
+class DeltaError(ValueError):
+    """Delta invalide (bloc inexistant, données non décodables...)."""
+
+
+# ---------------------------------------------------------
+# Flux des changements
+# ---------------------------------------------------------
+
+def mark_changed(db: Session, db_file: models.File, expected_seq: int = None) -> bool:
+    """
+    Donne à `db_file` le prochain numéro de changement (à appeler avant le
+    commit). Le MAX+1 est calculé dans l'UPDATE lui-même : SQLite sérialise
+    les écritures, deux workers ne peuvent pas obtenir le même numéro.
+    Avec `expected_seq`, l'UPDATE ne passe que si le fichier en est encore
+    à ce numéro : retourne False sinon (quelqu'un d'autre l'a modifié), à
+    l'appelant de faire un rollback. Le verrou d'écriture SQLite est alors
+    tenu jusqu'au commit.
+    """
+    db_file.updated_at = datetime.utcnow()
+    db.flush()
+    next_seq = (
+        db.query(func.coalesce(func.max(models.File.change_seq), 0) + 1)
+        .scalar_subquery()
+    )
+    stmt = update(models.File).where(models.File.id == db_file.id)
+    if expected_seq is not None:
+        stmt = stmt.where(models.File.change_seq == expected_seq)
+    result = db.execute(
+        stmt.values(change_seq=next_seq).execution_options(synchronize_session=False)
+    )
+    db.expire(db_file, ["change_seq"])
+    return result.rowcount == 1
+
+
+def backfill_change_seq(bind):
+    """
+    Fichiers d'avant le flux des changements (change_seq NULL) : on leur
+    donne des numéros après tous les existants pour qu'ils apparaissent
+    dans /sync/changes. Appelé par init_db, après add_missing_columns.
+    """
+    with bind.begin() as conn:
+        conn.exec_driver_sql(
+            "UPDATE files SET change_seq = "
+            "(SELECT COALESCE(MAX(change_seq), 0) FROM files) + id "
+            "WHERE change_seq IS NULL"
+        )
+
+
+# ---------------------------------------------------------
+# Signatures
+# ---------------------------------------------------------
+
+def file_signature(path: Path, block_size: int = DEFAULT_BLOCK_SIZE) -> list:
+    """[{"index", "weak", "strong"}] pour chaque bloc du fichier."""
+    blocks = []
+    with open(path, "rb") as f:
+        index = 0
+        while block := f.read(block_size):
+            blocks.append({
+                "index": index,
+                "weak": zlib.adler32(block),
+                "strong": hashlib.md5(block).hexdigest(),
+            })
+            index += 1
+    return blocks
+
+
+# ---------------------------------------------------------
+# Application d'un delta (serveur)
+# ---------------------------------------------------------
+
+def apply_delta(base_path: Path, instructions: list, block_size: int, dest_dir: Path,
+                expected_sha256: str = None, progress=None):
+    """
+    Construit la nouvelle version dans un fichier temporaire de `dest_dir`
+    (même disque que le fichier final), seulement si son sha256 vaut
+    `expected_sha256` (quand il est donné). L'appelant la met en place avec
+    os.replace une fois le changement validé en base (voir mark_changed),
+    et supprime le fichier temporaire sinon.
+    `instructions` : [{"op": "copy", "index": i, "count": n}
+                      | {"op": "data", "data": bytes}].
+    `progress(fichier, octets écrits)` est appelé après chaque écriture, puis
+    une dernière fois avec final=True, qui doit faire le fsync (voir
+    admission.checkpoint).
+    Retourne (chemin temporaire, taille, sha256).
+    """
+    base_size = base_path.stat().st_size
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(prefix=".sync-", dir=dest_dir)
+    try:
+        with open(base_path, "rb") as base, os.fdopen(fd, "wb") as out:
+            for ins in instructions:
+                if ins["op"] == "copy":
+                    start = ins["index"] * block_size
+                    length = ins.get("count", 1) * block_size
+                    if ins["index"] < 0 or start >= base_size:
+                        raise DeltaError(f"Bloc inexistant : {ins['index']}")
+                    base.seek(start)
+                    remaining = min(length, base_size - start)
+                    while remaining:
+                        chunk = base.read(min(_READ_SIZE, remaining))
+                        out.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                        remaining -= len(chunk)
+                        if progress:
+                            progress(out, size)
+                else:
+                    data = ins["data"]
+                    out.write(data)
+                    digest.update(data)
+                    size += len(data)
+                    if progress:
+                        progress(out, size)
+            if progress:
+                progress(out, size, final=True)
+            else:
+                out.flush()
+                os.fsync(out.fileno())
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise DeltaError("Empreinte sha256 différente après reconstruction")
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return Path(tmp_name), size, digest.hexdigest()
+
+
+# ---------------------------------------------------------
+# Calcul d'un delta (client de référence)
+# ---------------------------------------------------------
+
+def compute_delta(signature: list, data: bytes, block_size: int) -> list:
+    """
+    Compare `data` (nouvelle version) à la signature du serveur et retourne
+    les instructions du delta ("data" en bytes ; à encoder en base64 pour
+    l'API). Somme faible glissante = Adler-32, comme côté serveur.
+    """
+    by_weak = {}
+    for block in signature:
+        by_weak.setdefault(block["weak"], []).append(block)
+    last = signature[-1] if signature else None
+
+    instructions = []
+    literal = bytearray()
+
+    def emit_copy(index):
+        if literal:
+            instructions.append({"op": "data", "data": bytes(literal)})
+            literal.clear()
+        prev = instructions[-1] if instructions else None
+        if prev and prev["op"] == "copy" and prev["index"] + prev["count"] == index:
+            prev["count"] += 1
+        else:
+            instructions.append({"op": "copy", "index": index, "count": 1})
+
+    def match(window, weak):
+        for block in by_weak.get(weak, ()):
+            if hashlib.md5(window).hexdigest() == block["strong"]:
+                return block["index"]
+        return None
+
+    n = len(data)
+    pos = 0
+    a = b = None
+    while pos + block_size <= n:
+        if a is None:
+            weak = zlib.adler32(data[pos:pos + block_size])
+            a, b = weak & 0xFFFF, weak >> 16
+        else:
+            weak = (b << 16) | a
+        index = match(data[pos:pos + block_size], weak) if weak in by_weak else None
+        if index is not None:
+            emit_copy(index)
+            pos += block_size
+            a = None
+            continue
+        # on glisse d'un octet
+        out_byte = data[pos]
+        literal.append(out_byte)
+        pos += 1
+        if pos + block_size <= n:
+            in_byte = data[pos + block_size - 1]
+            a = (a - out_byte + in_byte) % _ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % _ADLER_MOD
+
+    tail = data[pos:]
+    if tail and last is not None and len(tail) < block_size:
+        if zlib.adler32(tail) == last["weak"] and hashlib.md5(tail).hexdigest() == last["strong"]:
+            emit_copy(last["index"])
+            tail = b""
+    literal.extend(tail)
+    if literal:
+        instructions.append({"op": "data", "data": bytes(literal)})
+    return instructions
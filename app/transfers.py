@@ -0,0 +1,269 @@
+"""
+Ordonnanceur des transferts (upload / download).
+
+Le Pi n'a qu'un lien Wi-Fi et un SSD USB : sans contrôle, un gros
+téléchargement monopolise tout et le listing des autres rame.
+
+- plafond global et plafond par utilisateur (octets / seconde) ;
+- partage pondéré : chaque transfert actif reçoit
+  plafond * poids / somme des poids actifs (global et par utilisateur,
+  on garde le plus petit des deux) ;
+- les petits fichiers (<= small_file_bytes) ne sont jamais ralentis,
+  les requêtes interactives (listing, login...) ne passent pas par ici.
+
+Un plafond à 0 veut dire "illimité". Configuration : section "transfers"
+de config/settings.json.
+
+Les gros transferts sont aussi déclarés dans SQLite (shared_state.py) :
+avec plusieurs workers, les plafonds restent globaux et non par processus.
+
+Uploads : FastAPI lit tout le corps multipart avant d'appeler le handler,
+le cadencement se fait donc sur le flux ASGI `receive` (PacedUploadMiddleware),
+c'est-à-dire au rythme où le serveur lit la socket. Le formulaire n'étant
+pas encore lu, l'utilisateur d'un upload est identifié par son IP.
+"""
+import asyncio
+import itertools
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional
+
+import anyio
+from starlette.responses import FileResponse, StreamingResponse
+
+from .config import get_section
+from .shared_state import get_transfer_registry
+
+DEFAULTS = {
+    "global_bytes_per_sec": 0,
+    "per_user_bytes_per_sec": 0,
+    "small_file_bytes": 2 * 1024 * 1024,
+    "chunk_size": 256 * 1024,
+    "role_weights": {},
+    "upload_paths": [r"^/workspace/upload$", r"^/sync/files/\d+/delta$"],
+}
+
+
+class Transfer:
+    """Un transfert en cours, cadencé par le scheduler."""
+
+    def __init__(self, scheduler, user: str, size: int, weight: float,
+                 direction: str, max_rate: Optional[float] = None):
+        self.scheduler = scheduler
+        self.id = next(scheduler._ids)
+        self.user = user
+        self.size = size
+        self.weight = weight
+        self.direction = direction
+        self.max_rate = max_rate
+        self.bytes_done = 0
+        self.started_at = time.monotonic()
+        self._next_send = self.started_at
+
+    @property
+    def paced(self) -> bool:
+        return self.size > self.scheduler.small_file_bytes or self.max_rate is not None
+
+    async def throttle(self, nbytes: int):
+        """À appeler avant d'envoyer / écrire `nbytes` octets."""
+        self.bytes_done += nbytes
+        registry = get_transfer_registry()
+        if self.paced and registry.stale():
+            await anyio.to_thread.run_sync(registry.refresh)
+        rate = self.scheduler.rate_for(self)
+        now = time.monotonic()
+        if rate is None:
+            self._next_send = now
+            return
+        delay = self._next_send - now
+        self._next_send = max(now, self._next_send) + nbytes / rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TransferScheduler:
+    def __init__(self, global_bytes_per_sec: float = 0, per_user_bytes_per_sec: float = 0,
+                 small_file_bytes: int = DEFAULTS["small_file_bytes"],
+                 chunk_size: int = DEFAULTS["chunk_size"], role_weights: Optional[dict] = None,
+                 upload_paths: Optional[list] = None):
+        self.global_rate = float(global_bytes_per_sec)
+        self.per_user_rate = float(per_user_bytes_per_sec)
+        self.small_file_bytes = int(small_file_bytes)
+        self.chunk_size = int(chunk_size)
+        self.role_weights = role_weights or {}
+        self.upload_paths = [re.compile(p) for p in (upload_paths or [])]
+        self._active = {}
+        self._ids = itertools.count(1)
+        # les handlers sync tournent dans des threads : on protège _active
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**get_section("transfers", DEFAULTS))
+
+    def weight_for_role(self, role: Optional[str]) -> float:
+        return float(self.role_weights.get(role, 1.0)) if role else 1.0
+
+    @asynccontextmanager
+    async def transfer(self, user: str, size: int, direction: str,
+                       weight: float = 1.0, max_rate: Optional[float] = None):
+        t = Transfer(self, user, size, weight, direction, max_rate)
+        registry = get_transfer_registry()
+        with self._lock:
+            self._active[t.id] = t
+        if t.paced:
+            await anyio.to_thread.run_sync(registry.register, t)
+        try:
+            yield t
+        finally:
+            with self._lock:
+                self._active.pop(t.id, None)
+            if t.paced:
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(registry.unregister, t)
+
+    def rate_for(self, transfer: Transfer) -> Optional[float]:
+        """Débit alloué à `transfer` (octets/s), None = pas de limite."""
+        if not transfer.paced:
+            return None
+        with self._lock:
+            paced = [(t.user, t.weight) for t in self._active.values() if t.paced]
+        paced += get_transfer_registry().remote()
+        rates = []
+        if transfer.max_rate:
+            rates.append(transfer.max_rate)
+        if self.global_rate > 0:
+            total = sum(w for _, w in paced) or transfer.weight
+            rates.append(self.global_rate * transfer.weight / total)
+        if self.per_user_rate > 0:
+            total = sum(w for u, w in paced if u == transfer.user) or transfer.weight
+            rates.append(self.per_user_rate * transfer.weight / total)
+        return min(rates) if rates else None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            active = list(self._active.values())
+        return {
+            "global_bytes_per_sec": self.global_rate,
+            "per_user_bytes_per_sec": self.per_user_rate,
+            "small_file_bytes": self.small_file_bytes,
+            "active": [
+                {
+                    "id": t.id,
+                    "user": t.user,
+                    "direction": t.direction,
+                    "size": t.size,
+                    "bytes_done": t.bytes_done,
+                    "weight": t.weight,
+                    "paced": t.paced,
+                    "rate": self.rate_for(t),
+                    "elapsed": round(now - t.started_at, 3),
+                }
+                for t in active
+            ],
+        }
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> TransferScheduler:
+    return TransferScheduler.from_settings()
+
+
+class ScheduledFileResponse(FileResponse):
+    """
+    FileResponse dont chaque morceau envoyé passe par le scheduler.
+    On garde tout le reste de FileResponse (Range, HEAD, ETag...).
+    """
+
+    def __init__(self, path, *, user: str, weight: float = 1.0,
+                 max_rate: Optional[float] = None, scheduler: Optional[TransferScheduler] = None,
+                 **kwargs):
+        self.scheduler = scheduler or get_scheduler()
+        super().__init__(path, **kwargs)
+        self.chunk_size = self.scheduler.chunk_size
+        self.user = user
+        self.weight = weight
+        self.max_rate = max_rate
+
+    async def __call__(self, scope, receive, send):
+        # pas de "pathsend" : le serveur enverrait le fichier sans nous
+        extensions = {k: v for k, v in scope.get("extensions", {}).items()
+                      if k != "http.response.pathsend"}
+        scope = {**scope, "extensions": extensions}
+        size = int(self.headers.get("content-length", 0))
+
+        async with self.scheduler.transfer(self.user, size, "download",
+                                           self.weight, self.max_rate) as transfer:
+            async def paced_send(message):
+                if message["type"] == "http.response.body":
+                    await transfer.throttle(len(message.get("body", b"")))
+                await send(message)
+
+            await super().__call__(scope, receive, paced_send)
+
+
+class ScheduledStreamingResponse(StreamingResponse):
+    """
+    Même chose pour un contenu généré (ancienne version reconstituée depuis
+    ses chunks) : `size` sert au choix "petit fichier" du scheduler.
+    """
+
+    def __init__(self, content, *, size: int, user: str, weight: float = 1.0,
+                 max_rate: Optional[float] = None, scheduler: Optional[TransferScheduler] = None,
+                 **kwargs):
+        self.scheduler = scheduler or get_scheduler()
+        super().__init__(content, **kwargs)
+        self.size = size
+        self.user = user
+        self.weight = weight
+        self.max_rate = max_rate
+
+    async def __call__(self, scope, receive, send):
+        async with self.scheduler.transfer(self.user, self.size, "download",
+                                           self.weight, self.max_rate) as transfer:
+            async def paced_send(message):
+                if message["type"] == "http.response.body":
+                    await transfer.throttle(len(message.get("body", b"")))
+                await send(message)
+
+            await super().__call__(scope, receive, paced_send)
+
+
+class PacedUploadMiddleware:
+    """
+    Middleware ASGI : le corps des POST sur `upload_paths` est lu au débit
+    alloué par le scheduler (le client est freiné par TCP), avant même que
+    FastAPI ne le reçoive.
+    """
+
+    def __init__(self, app, scheduler: Optional[TransferScheduler] = None):
+        self.app = app
+        self.scheduler = scheduler
+
+    async def __call__(self, scope, receive, send):
+        scheduler = self.scheduler or get_scheduler()
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not any(p.match(scope["path"]) for p in scheduler.upload_paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"0")
+        size = int(length) if length.isdigit() else 0
+        client = scope.get("client")
+        user = client[0] if client else "anonymous"
+
+        async with scheduler.transfer(user, size, "upload") as transfer:
+            async def paced_receive():
+                message = await receive()
+                if message["type"] == "http.request":
+                    await transfer.throttle(len(message.get("body", b"")))
+                return message
+
+            await self.app(scope, paced_receive, send)
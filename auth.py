@@ -1,36 +0,0 @@
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-
-from . import models
-
-# Contexte de hashage des mots de passe (bcrypt)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-def hash_password(password: str) -> str:
-    """Retourne un hash bcrypt du mot de passe."""
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Vérifie si le mot de passe en clair correspond au hash."""
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_user_by_username(db: Session, username: str):
-    """Retourne un utilisateur à partir de son username, ou None."""
-    return db.query(models.User).filter(models.User.username == username).first()
-
-
-def authenticate_user(db: Session, username: str, password: str):
-    """
-    Vérifie username + password.
-    Retourne l'objet User si OK, sinon None.
-    """
-    user = get_user_by_username(db, username)
-    if not user:
-        return None
-    if not verify_password(password, user.password_hash):
-        return None
-    return user
-
@@ -0,0 +1,22 @@
+"""
+Lancement multi-workers (un processus par cœur du Pi 4) :
+
+    gunicorn 'app.main:create_app()' -c gunicorn.conf.py
+
+L'état partagé entre workers passe par SQLite (app/shared_state.py).
+Variables d'environnement : HCD_BIND (défaut 0.0.0.0:8000), HCD_WORKERS (défaut 4).
+"""
+import os
+
+bind = os.environ.get("HCD_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("HCD_WORKERS", "4"))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Chaque worker exécute le lifespan (init_db, nettoyage de l'état partagé) :
+# pas de preload, sinon la connexion SQLite serait partagée après fork().
+preload_app = False
+
+# Les gros transferts sont longs : on ne tue pas un worker qui streame.
+timeout = 0
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,121 @@
+"""
+Request-throughput benchmark for 1..N server workers.
+Usage: python scripts/bench_workers.py [--workers 1 2 4] [--duration 10]
+                                       [--clients 4] [--concurrency 16]
+                                       [--path /workspace/files]
+
+For each worker count, the server is started with the supported launcher
+(`gunicorn 'app.main:create_app()' -c gunicorn.conf.py`, HCD_WORKERS=N), then `--clients` load-generator
+processes (each with `--concurrency / --clients` keep-alive connections)
+hit `--path` for `--duration` seconds. The report gives requests/s and the
+scaling relative to 1 worker (ideal: xN).
+
+Run it on the Pi itself with nothing else loaded; the load generator shares
+the CPU with the server, so keep --clients small (e.g. 2 on a Pi 4).
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _client(port: int, path: str, connections: int, duration: float):
+    """One load-generator process: `connections` threads in a loop."""
+    counts = [0] * connections
+    errors = [0] * connections
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        while time.perf_counter() < deadline:
+            try:
+                conn.request("GET", path)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status == 200:
+                    counts[i] += 1
+                else:
+                    errors[i] += 1
+            except (OSError, http.client.HTTPException):
+                errors[i] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts), sum(errors)
+
+
+def _wait_ready(port: int, timeout: float = 30.0) -> bool:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=0.5) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def run(workers: int, args) -> float:
+    env = dict(os.environ, HCD_BIND=f"127.0.0.1:{args.port}", HCD_WORKERS=str(workers))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:create_app()", "-c", "gunicorn.conf.py",
+         "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        if not _wait_ready(args.port):
+            raise RuntimeError("server did not start")
+        time.sleep(1.0)  # tous les workers ont fini leur lifespan
+        per_client = max(1, args.concurrency // args.clients)
+        with ProcessPoolExecutor(args.clients) as pool:
+            futures = [pool.submit(_client, args.port, args.path, per_client, args.duration)
+                       for _ in range(args.clients)]
+            results = [f.result() for f in futures]
+        ok = sum(r[0] for r in results)
+        errors = sum(r[1] for r in results)
+        rps = ok / args.duration
+        print(f"workers={workers:<3} requests={ok:<8} errors={errors:<5} {rps:>9.1f} req/s")
+        return rps
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--path", default="/workspace/files")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}  path: {args.path}  duration: {args.duration}s")
+    results = {w: run(w, args) for w in args.workers}
+
+    base = results.get(1) or next(iter(results.values()))
+    print()
+    print(f"{'WORKERS':<8}{'REQ/S':>10}{'SCALING':>10}{'IDEAL':>8}")
+    for w, rps in results.items():
+        print(f"{w:<8}{rps:>10.1f}{rps / base:>9.2f}x{w:>7}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""
+Build the frontend for production: fingerprinted file names, gzip/brotli
+variants and rewritten URLs in static/dist/index.html.
+Usage: python scripts/build_static.py
+Brotli variants are only produced if the optional "brotli" package is installed.
+Run it again after every change to static/ (then restart the server).
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.static_assets import STATIC_DIR, DIST_DIRNAME, build_static_assets, brotli  # noqa: E402
+
+
+def main():
+    manifest = build_static_assets(STATIC_DIR)
+    print(f"Built {STATIC_DIR / DIST_DIRNAME}:")
+    for name, hashed in manifest.items():
+        print(f"  {name:<12} -> /static/{hashed}")
+    if brotli is None:
+        print("(brotli not installed: only .gz variants were generated)")
+
+
+if __name__ == '__main__':
+    main()
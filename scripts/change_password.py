@@ -5,9 +5,11 @@ The script will prompt for the new password (hidden).
 """
 import sys
 from getpass import getpass
+from sqlalchemy.exc import OperationalError
 from app.database import SessionLocal
 from app import models
 from app.auth import hash_password, verify_password
+from app.cache import invalidate_user
 
 
 def main():
@@ -40,6 +42,11 @@ def main():
     user.password_hash = hash_password(newp)
     db.add(user)
     db.commit()
+    # le serveur en cours d'exécution relira l'utilisateur (voir app/shared_state.py)
+    try:
+        invalidate_user(username)
+    except OperationalError:
+        pass  # serveur jamais démarré : pas de cache à invalider
     print(f"Password updated for user '{username}'.")
 
 
@@ -0,0 +1,109 @@
+"""
+Measure server startup: import time per module (import of app.main, then
+create_app()), and time to the first `/health` 200 with
+`uvicorn --factory app.main:create_app`.
+Usage: python scripts/startup_report.py [--top 15] [--target 3.0] [--port 8765]
+
+Target (Raspberry Pi 4): `/health` answers 200 in less than 3 seconds after
+the process is launched. See README, "Démarrage rapide", for the measured
+numbers and how this budget was chosen.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_times(code: str):
+    """Run `python -X importtime -c <code>` and parse its report.
+    Returns a list of (cumulative_us, self_us, module_name)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+def time_to_health(port: int, timeout: float = 30.0):
+    """Launch uvicorn and poll /health until it answers 200.
+    Returns the elapsed seconds, or None on timeout."""
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "app.main:create_app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=dict(os.environ),
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=0.5) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            if proc.poll() is not None:
+                return None
+            time.sleep(0.01)
+        return None
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--target", type=float, default=3.0,
+                        help="readiness target in seconds (default: 3.0)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    bare = import_times("import app.main")
+    bare_total = next((c for c, _, n in bare if n.strip() == "app.main"), 0)
+    print(f"=== import app.main alone: {bare_total / 1000:.1f} ms ===")
+    print()
+
+    # create_app() importe FastAPI, SQLAlchemy et les routeurs : c'est le
+    # vrai coût du démarrage, on le mesure séparément.
+    rows = import_times("import app.main; app.main.create_app()")
+    total = sum(c for c, _, n in rows if len(n) - len(n.lstrip()) <= 1)
+    print(f"=== Import time (app.main + create_app(): {total / 1000:.1f} ms) ===")
+    print(f"{'CUMUL (ms)':>11} {'SELF (ms)':>10}  MODULE")
+    for cumulative, self_, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"{cumulative / 1000:>11.1f} {self_ / 1000:>10.1f}  {name}")
+
+    print()
+    app_rows = [r for r in rows if r[2].strip().startswith("app.")]
+    print("=== app.* modules ===")
+    for cumulative, self_, name in sorted(app_rows, reverse=True):
+        print(f"{cumulative / 1000:>11.1f} {self_ / 1000:>10.1f}  {name.strip()}")
+
+    print()
+    elapsed = time_to_health(args.port)
+    if elapsed is None:
+        print("[!] /health did not answer 200.")
+        sys.exit(1)
+    verdict = "OK" if elapsed <= args.target else "TOO SLOW"
+    print(f"Time to first /health 200: {elapsed:.3f} s "
+          f"(target {args.target:.1f} s) -> {verdict}")
+    if elapsed > args.target:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
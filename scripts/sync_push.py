@@ -0,0 +1,65 @@
+"""
+Push a local file to the server as a delta (only the changed blocks are sent).
+Usage: python scripts/sync_push.py <file_id> <local_path> <username>
+                                   [--server http://127.0.0.1:8000] [--block-size 65536]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import sys
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.sync import DEFAULT_BLOCK_SIZE, compute_delta  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("file_id", type=int)
+    parser.add_argument("local_path")
+    parser.add_argument("username")
+    parser.add_argument("--server", default="http://127.0.0.1:8000")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    args = parser.parse_args()
+
+    base = args.server.rstrip("/")
+    url = f"{base}/sync/files/{args.file_id}/signature?block_size={args.block_size}"
+    with urllib.request.urlopen(url) as resp:
+        sig = json.load(resp)
+
+    data = Path(args.local_path).read_bytes()
+    instructions = compute_delta(sig["blocks"], data, sig["block_size"])
+    literal = sum(len(i["data"]) for i in instructions if i["op"] == "data")
+    for ins in instructions:
+        if ins["op"] == "data":
+            ins["data"] = base64.b64encode(ins["data"]).decode("ascii")
+
+    body = json.dumps({
+        "username": args.username,
+        "block_size": sig["block_size"],
+        "base_change_seq": sig["change_seq"],
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "instructions": instructions,
+    }).encode("utf-8")
+    req = urllib.request.Request(
+        f"{base}/sync/files/{args.file_id}/delta",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req) as resp:
+            result = json.load(resp)
+    except urllib.error.HTTPError as exc:
+        print(f"[!] {exc.code} {exc.read().decode('utf-8', 'replace')}")
+        sys.exit(1)
+
+    print(f"Sent {literal} literal bytes out of {len(data)} "
+          f"({len(body)} bytes on the wire). New change_seq: {result['file']['change_seq']}")
+
+
+if __name__ == '__main__':
+    main()